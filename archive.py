@@ -1,21 +1,49 @@
 import time
-from ibm_boto3 import client
+import random
+import atexit
+import signal
+import sys
+from ibm_boto3.session import Session
 from ibm_botocore.client import Config
+from ibm_botocore.credentials import DefaultTokenManager
+from ibm_botocore.exceptions import ClientError, ConnectionError, HTTPClientError
 import os
 from dotenv import load_dotenv
 import logging
 from tqdm import tqdm
 import glob
-from datetime import timedelta
+import heapq
+import json
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 # --- Control Plane: All configurable parameters in one place ---
 
 MAX_KEYS_PER_FILE = 250            # Max lines per key file before rotating
-BATCH_SIZE = 100                   # Number of objects per batch
+KEY_FILE_BUFFER_SIZE = 1 << 16     # I/O buffer (in bytes) of the copied keys files
+SORT_CHUNK_SIZE = 1_000_000        # Keys sorted in memory at once when consolidating the copied keys files
+CONSOLIDATE_THRESHOLD = 100_000    # Copied keys held in the rotated files before they are merged into the sorted file
+BATCH_SIZE = 100                   # Number of finished copies between writing out keys
+MAX_PENDING_COPIES = 400           # Max copies submitted to the workers but not finished yet (at least 2x the workers)
+MULTIPART_COPY_THRESHOLD = 5 << 30   # Objects above this size (the CopyObject limit) are copied in parts
+MULTIPART_COPY_PART_SIZE = 100 << 20 # Size of one part of a multipart copy
+MAX_UPLOAD_PARTS = 10000           # Max number of parts per multipart upload
+LIST_PAGE_SIZE = 1000              # Number of keys per list_objects_v2 page
 MAX_RETRIES = 3                    # Max retries for copy operations
 BACKOFF_FACTOR = 2                 # Exponential backoff factor
-THROTTLE_DELAY = 0.1               # Delay (in seconds) between API calls
+BACKOFF_BASE = 0.1                 # Base delay (in seconds) for the first retry
+BACKOFF_CAP = 30.0                 # Upper bound (in seconds) for a single backoff delay
 USE_EMOJIS = True                  # Emoji output in logs
+VERBOSE = False                    # Console and log line for every archived object (errors are always reported)
+MAX_WORKERS = 64                   # Number of parallel copy threads (override with COS_MAX_WORKERS in .env)
+MAX_POOL_CONNECTIONS = 128         # HTTP connection pool size of the S3 client
+WORKER_POOL_CONNECTIONS = 2        # HTTP connection pool size of each copy worker's own S3 client
+CONNECT_TIMEOUT = 5                # Seconds to wait for a new connection to COS
+READ_TIMEOUT = 120                 # Seconds to wait for a response (large objects take a while to copy)
+MAX_REQUESTS_PER_SECOND = 3000     # Client-side copy rate limit (override with COS_MAX_RPS in .env)
+RATE_LIMIT_BURST = 3500            # Max number of requests allowed in a single burst
 
 COPIED_KEYS_DIR = "copied_keys"
 FAILED_KEYS_DIR = "failed_keys"
@@ -27,6 +55,8 @@ os.makedirs(LOG_DIR, exist_ok=True)
 
 COPIED_KEYS_PREFIX = os.path.join(COPIED_KEYS_DIR, "copied_keys")
 FAILED_KEYS_PREFIX = os.path.join(FAILED_KEYS_DIR, "failed_keys")
+SORTED_COPIED_KEYS_FILE = f"{COPIED_KEYS_PREFIX}.sorted"
+LISTING_CHECKPOINT_FILE = os.path.join(COPIED_KEYS_DIR, "listing_checkpoint.json")
 LOG_FILE = os.path.join(LOG_DIR, "cos_batch_copy.log")
 ENV_FILE_PATH = os.path.join(os.path.dirname(__file__), ".env")
 
@@ -92,7 +122,8 @@ def ensure_env():
 
 logging.basicConfig(
     filename=LOG_FILE,
-    level=logging.INFO,
+    # Per-object success lines are logged at DEBUG level
+    level=logging.DEBUG if VERBOSE else logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
@@ -108,224 +139,679 @@ RETRY_ICON = get_icon("♻️", "[RETRY]")
 INFO_ICON = get_icon("🔄", "[INFO]")
 MAIL_ICON = get_icon("📭", "[NO FAILED KEYS]")
 
-def retry_with_backoff(func, max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR):
-    """Executes a function with exponential backoff."""
+# CopyObject rejects objects above 5 GiB with one of these codes
+TOO_LARGE_ERROR_CODES = {"EntityTooLarge", "InvalidRequest"}
+# Storage classes the listing reports for objects that are already archived
+ARCHIVE_STORAGE_CLASSES = {"GLACIER", "ACCELERATED"}
+# Error codes that indicate a temporary condition on the COS side and are worth retrying
+TRANSIENT_ERROR_CODES = {"SlowDown", "ServiceUnavailable", "RequestTimeout", "InternalError", "TooManyRequests", "503"}
+
+def is_transient_error(e):
+    """Returns True if the exception is a throttling, server-side or network error that may succeed on retry."""
+    if isinstance(e, ClientError):
+        error = e.response.get("Error", {})
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return error.get("Code") in TRANSIENT_ERROR_CODES or status in (429, 500, 503)
+    return isinstance(e, (ConnectionError, HTTPClientError))
+
+def is_archived_error(e):
+    """Returns True if CopyObject refused the object because it is already in the archive tier."""
+    return isinstance(e, ClientError) and e.response.get("Error", {}).get("Code") == "InvalidObjectState"
+
+def retry_with_backoff(func, max_retries=MAX_RETRIES, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Executes a function with "full jitter" exponential backoff. Non-transient errors are raised immediately."""
     for attempt in range(1, max_retries + 1):
         try:
             return func()
         except Exception as e:
-            if attempt == max_retries:
+            if attempt == max_retries or not is_transient_error(e):
                 raise
-            time.sleep(backoff_factor ** attempt)
+            time.sleep(random.uniform(0, min(cap, base * BACKOFF_FACTOR ** (attempt - 1))))
+
+# --- Rate limiting ---
+
+class TokenBucket:
+    """Thread-safe token bucket that limits the request rate across all copy workers."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+RATE_LIMITER = None
+RATE_LIMITER_LOCK = threading.Lock()
+
+def get_rate_limiter():
+    """Returns the shared token bucket, created on first use so that COS_MAX_RPS from the .env file is honored."""
+    global RATE_LIMITER
+    with RATE_LIMITER_LOCK:
+        if RATE_LIMITER is None:
+            rate = float(os.environ.get("COS_MAX_RPS", MAX_REQUESTS_PER_SECOND))
+            RATE_LIMITER = TokenBucket(rate=rate, capacity=RATE_LIMIT_BURST)
+    return RATE_LIMITER
+
+# --- S3 clients ---
+
+TOKEN_MANAGER = None
+TOKEN_MANAGER_LOCK = threading.Lock()
+THREAD_LOCAL = threading.local()
+COPY_EXECUTOR = None
+COPY_WORKERS = MAX_WORKERS
+S3_CLIENT = None
+S3_CLIENT_LOCK = threading.Lock()
+
+def get_token_manager():
+    """Returns the IAM token manager shared by all S3 clients, so the token is only fetched and refreshed once."""
+    global TOKEN_MANAGER
+    with TOKEN_MANAGER_LOCK:
+        if TOKEN_MANAGER is None:
+            TOKEN_MANAGER = DefaultTokenManager(api_key_id=os.environ['IAM_API_KEY'])
+    return TOKEN_MANAGER
+
+def create_s3_client(max_pool_connections=MAX_POOL_CONNECTIONS):
+    """Creates an S3 client on its own session for the configured region."""
+    return Session().client(
+        's3',
+        ibm_api_key_id=os.environ['IAM_API_KEY'],
+        token_manager=get_token_manager(),
+        # Request parameters are built by this script, so botocore's per-call
+        # parameter validation is skipped
+        config=Config(
+            signature_version='oauth',
+            max_pool_connections=max_pool_connections,
+            retries={'max_attempts': 0},
+            parameter_validation=False,
+            # Keep idle pooled connections alive so TLS sessions are reused
+            tcp_keepalive=True,
+            connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=READ_TIMEOUT
+        ),
+        endpoint_url=f"https://s3.{os.environ['REGION']}.cloud-object-storage.appdomain.cloud"
+    )
 
-def throttle(api_call, delay=THROTTLE_DELAY):
-    """Throttles API calls."""
-    time.sleep(delay)
-    return api_call()
+def get_s3_client():
+    """Returns the shared S3 client used for listing, created on first use."""
+    global S3_CLIENT
+    with S3_CLIENT_LOCK:
+        if S3_CLIENT is None:
+            S3_CLIENT = create_s3_client()
+    return S3_CLIENT
+
+def get_thread_s3_client():
+    """Returns the S3 client of the calling worker thread, creating it on first use."""
+    s3 = getattr(THREAD_LOCAL, "s3", None)
+    if s3 is None:
+        s3 = THREAD_LOCAL.s3 = create_s3_client(max_pool_connections=WORKER_POOL_CONNECTIONS)
+    return s3
+
+def get_copy_executor():
+    """Returns the thread pool of copy workers. It lives for the whole run so the per-thread clients are reused."""
+    global COPY_EXECUTOR, COPY_WORKERS
+    if COPY_EXECUTOR is None:
+        COPY_WORKERS = int(os.environ.get("COS_MAX_WORKERS", MAX_WORKERS))
+        COPY_EXECUTOR = ThreadPoolExecutor(max_workers=COPY_WORKERS, thread_name_prefix="copy")
+    return COPY_EXECUTOR
 
 # --- Key handling with file rotation ---
 
+def read_keys(fname):
+    """Returns the keys of a key file, split in one pass over the whole file instead of line by line."""
+    with open(fname, "r") as f:
+        return [key for key in f.read().split("\n") if key]
+
 def load_all_keys(prefix):
-    files = sorted(glob.glob(f"{prefix}_*.txt"))
     keys = set()
-    for fname in files:
-        with open(fname, "r") as f:
-            keys.update(line.strip() for line in f)
+    for fname in glob.glob(f"{prefix}_*.txt"):
+        keys.update(read_keys(fname))
     return keys
 
-def get_current_file(prefix):
-    files = sorted(glob.glob(f"{prefix}_*.txt"))
-    if not files:
-        return f"{prefix}_1.txt"
-    return files[-1]
-
-def save_key(key, prefix):
-    fname = get_current_file(prefix)
-    # Check line count
-    if os.path.exists(fname):
-        with open(fname, "r") as f:
-            lines = sum(1 for _ in f)
-    else:
-        lines = 0
-    if lines >= MAX_KEYS_PER_FILE:
-        idx = int(fname.split('_')[-1].split('.')[0]) + 1
-        fname = f"{prefix}_{idx}.txt"
-    with open(fname, "a") as f:
-        f.write(f"{key}\n")
+KEY_FILE_INDEX = re.compile(r"_(\d+)\.txt$")
 
-def load_copied_keys():
-    return load_all_keys(COPIED_KEYS_PREFIX)
+def file_index(fname):
+    """Returns the rotation index N of a <prefix>_N.txt key file."""
+    return int(KEY_FILE_INDEX.search(fname).group(1))
+
+def get_current_file(prefix):
+    """Returns the key file with the highest rotation index, found with a single directory scan."""
+    directory, base = os.path.split(prefix)
+    max_idx = 1
+    with os.scandir(directory or ".") as entries:
+        for entry in entries:
+            match = KEY_FILE_INDEX.search(entry.name)
+            if match and entry.name[:match.start()] == base:
+                max_idx = max(max_idx, int(match.group(1)))
+    return f"{prefix}_{max_idx}.txt"
+
+def count_lines(fname):
+    """Returns the number of lines in a file, or 0 if it does not exist."""
+    if not os.path.exists(fname):
+        return 0
+    with open(fname, "r") as f:
+        return sum(1 for _ in f)
+
+class KeyWriter:
+    """Appends keys to rotated key files through one persistent, buffered file handle.
+
+    The current file and its line count are only looked up on disk when the
+    handle is (re)opened, so writing a key is an in-memory append.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.file = None
+        self.index = None
+        self.lines = 0
+        self.lock = threading.Lock()
+
+    def _open(self):
+        """Opens the key file for appending: the next one after a rotation, otherwise the current one on disk."""
+        if self.index is not None:
+            self.index += 1
+            lines = 0
+        else:
+            fname = get_current_file(self.prefix)
+            self.index = file_index(fname)
+            lines = count_lines(fname)
+            if lines >= MAX_KEYS_PER_FILE:
+                self.index += 1
+                lines = 0
+        self.file = open(f"{self.prefix}_{self.index}.txt", "a", buffering=KEY_FILE_BUFFER_SIZE)
+        self.lines = lines
+
+    def write(self, keys):
+        """Appends keys, moving to the next file every MAX_KEYS_PER_FILE lines."""
+        with self.lock:
+            pos = 0
+            while pos < len(keys):
+                if self.file is not None and self.lines >= MAX_KEYS_PER_FILE:
+                    self.file.close()
+                    self.file = None
+                if self.file is None:
+                    self._open()
+                chunk = keys[pos:pos + MAX_KEYS_PER_FILE - self.lines]
+                self.file.write("".join(f"{key}\n" for key in chunk))
+                self.lines += len(chunk)
+                pos += len(chunk)
+
+    def flush(self):
+        """Writes buffered keys to disk."""
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        """Flushes and closes the current file. The next write looks up the current file on disk again."""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.index = None
+
+COPIED_KEYS_WRITER = KeyWriter(COPIED_KEYS_PREFIX)
+FAILED_KEYS_WRITER = KeyWriter(FAILED_KEYS_PREFIX)
 
 def save_copied_key(key):
-    save_key(key, COPIED_KEYS_PREFIX)
+    COPIED_KEYS_WRITER.write([key])
+
+def flush_copied_keys():
+    """Writes buffered copied keys to disk."""
+    COPIED_KEYS_WRITER.flush()
+
+def close_copied_keys():
+    """Flushes and closes the copied keys file."""
+    COPIED_KEYS_WRITER.close()
+
+atexit.register(close_copied_keys)
+
+# --- Sorted copied keys ---
+# Copied keys are appended to the rotated copied_keys files during a run.
+# Once those hold more than CONSOLIDATE_THRESHOLD keys they are merged into
+# one sorted file and removed. A run checks the (lexicographically ordered)
+# bucket listing against the sorted file in lockstep, so only the few keys
+# of the rotated files are held in memory.
+
+class SortedKeyFilter:
+    """Membership test against the sorted copied keys file plus a set of recent keys, for keys asked in ascending order."""
+
+    def __init__(self, fname, recent_keys=()):
+        self.file = open(fname, "r", buffering=KEY_FILE_BUFFER_SIZE)
+        self.recent_keys = set(recent_keys)
+        self.lines_read = 0
+        # Recent keys that are also in the sorted file, e.g. after a crash
+        # between consolidating and removing the rotated files
+        self.duplicates = 0
+        self.current = self._next()
+
+    def _next(self):
+        line = self.file.readline()
+        if not line:
+            return None
+        self.lines_read += 1
+        key = line.rstrip("\n")
+        if key in self.recent_keys:
+            self.duplicates += 1
+        return key
+
+    def __contains__(self, key):
+        if key in self.recent_keys:
+            return True
+        # Keys out of order are simply reported as not copied, which only
+        # costs a redundant in-place copy
+        while self.current is not None and self.current < key:
+            self.current = self._next()
+        return self.current == key
+
+    def close(self):
+        """Reads to the end of the file and returns the total number of distinct keys known."""
+        while self.current is not None:
+            self.current = self._next()
+        self.file.close()
+        return self.lines_read + len(self.recent_keys) - self.duplicates
+
+def _write_sorted_keys(streams):
+    """Merges sorted key streams into the sorted copied keys file, dropping duplicates."""
+    tmp_fname = f"{SORTED_COPIED_KEYS_FILE}.tmp"
+    last = None
+    with open(tmp_fname, "w", buffering=KEY_FILE_BUFFER_SIZE) as f:
+        for key in heapq.merge(*streams):
+            if key != last:
+                f.write(f"{key}\n")
+                last = key
+    os.replace(tmp_fname, SORTED_COPIED_KEYS_FILE)
+
+def consolidate_copied_keys():
+    """Merges the copied keys files into the sorted file with an external merge sort, then removes them."""
+    close_copied_keys()
+    key_files = glob.glob(f"{COPIED_KEYS_PREFIX}_*.txt")
+    run_files = []
+    chunk = []
+
+    def write_run():
+        fname = f"{SORTED_COPIED_KEYS_FILE}.run{len(run_files)}"
+        chunk.sort()
+        with open(fname, "w", buffering=KEY_FILE_BUFFER_SIZE) as f:
+            f.writelines(f"{key}\n" for key in chunk)
+        run_files.append(fname)
+        chunk.clear()
+
+    for fname in key_files:
+        chunk.extend(read_keys(fname))
+        if len(chunk) >= SORT_CHUNK_SIZE:
+            write_run()
+    if chunk:
+        write_run()
+
+    if os.path.exists(SORTED_COPIED_KEYS_FILE):
+        run_files.append(SORTED_COPIED_KEYS_FILE)
+    runs = [open(fname, "r", buffering=KEY_FILE_BUFFER_SIZE) for fname in run_files]
+    try:
+        _write_sorted_keys([(line.rstrip("\n") for line in run) for run in runs])
+    finally:
+        for run in runs:
+            run.close()
+    # The sorted file now holds every key, so the sources can go
+    for fname in run_files + key_files:
+        if fname != SORTED_COPIED_KEYS_FILE:
+            os.remove(fname)
+
+def open_copied_keys():
+    """Returns a SortedKeyFilter over all copied keys, consolidating the copied keys files first if they have grown large."""
+    key_files = glob.glob(f"{COPIED_KEYS_PREFIX}_*.txt")
+    # Every full file holds MAX_KEYS_PER_FILE keys, so the file count is a cheap upper bound
+    if len(key_files) * MAX_KEYS_PER_FILE > CONSOLIDATE_THRESHOLD:
+        consolidate_copied_keys()
+    elif not os.path.exists(SORTED_COPIED_KEYS_FILE):
+        _write_sorted_keys([])
+    return SortedKeyFilter(SORTED_COPIED_KEYS_FILE, load_all_keys(COPIED_KEYS_PREFIX))
 
 def load_failed_keys():
     return list(load_all_keys(FAILED_KEYS_PREFIX))
 
 def save_failed_key(key):
-    save_key(key, FAILED_KEYS_PREFIX)
-
-def clear_failed_keys():
-    for fname in glob.glob(f"{FAILED_KEYS_PREFIX}_*.txt"):
-        open(fname, "w").close()
-
-def count_total_keys(s3, bucket, prefix=""):
-    total = 0
-    paginator = s3.get_paginator('list_objects_v2')
-    paginate_kwargs = {"Bucket": bucket}
-    if prefix:
-        paginate_kwargs["Prefix"] = prefix
-    for page in paginator.paginate(**paginate_kwargs):
-        total += len(page.get('Contents', []))
-    return total
-
-def process_batch(s3, source_bucket, destination_bucket, batch, batch_number, copied_keys, max_retries=MAX_RETRIES):
-    successful_copies = 0
-    keyprotect_crn = os.environ.get("KEY_PROTECT_CRN")
-    for key in batch:
-        if key in copied_keys:
-            continue
-
-        copy_source = {
-            'Bucket': source_bucket,
-            'Key': key
-        }
-
-        def copy_object():
-            kwargs = dict(
-                CopySource=copy_source,
+    FAILED_KEYS_WRITER.write([key])
+
+def flush_failed_keys():
+    """Writes buffered failed keys to disk."""
+    FAILED_KEYS_WRITER.flush()
+
+def close_failed_keys():
+    """Flushes and closes the failed keys file."""
+    FAILED_KEYS_WRITER.close()
+
+atexit.register(close_failed_keys)
+
+def _exit_on_sigterm(signum, frame):
+    """Turns SIGTERM into a normal exit so the atexit handlers write out all buffered keys."""
+    sys.exit(128 + signum)
+
+signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+class ListingCheckpoint:
+    """Tracks the last listed key up to which every object has been handled, so an aborted run resumes the listing there.
+
+    Keys are listed in ascending order but copies finish out of order, so the
+    checkpoint only moves past a key once it and all keys before it are done.
+    """
+
+    def __init__(self, source_bucket, prefix):
+        self.source_bucket = source_bucket
+        self.prefix = prefix
+        self.last_listed = None
+        # (key, key listed before it) of submitted copies that have not finished in order yet
+        self.outstanding = deque()
+        self.finished = set()
+
+    def load(self):
+        """Returns the key to resume the listing after, or None to list from the start."""
+        if not os.path.exists(LISTING_CHECKPOINT_FILE):
+            return None
+        with open(LISTING_CHECKPOINT_FILE, "r") as f:
+            state = json.load(f)
+        if state.get("bucket") != self.source_bucket or state.get("prefix") != self.prefix:
+            return None
+        self.last_listed = state.get("start_after")
+        return self.last_listed
+
+    def listed(self, key, submitted):
+        """Records a listed key and whether a copy was submitted for it."""
+        if submitted:
+            self.outstanding.append((key, self.last_listed))
+        self.last_listed = key
+
+    def done(self, key):
+        """Records that the copy of key finished (successfully or not)."""
+        self.finished.add(key)
+        while self.outstanding and self.outstanding[0][0] in self.finished:
+            self.finished.discard(self.outstanding.popleft()[0])
+
+    def save(self):
+        """Writes the checkpoint. Call only after the copied and failed keys are flushed."""
+        start_after = self.outstanding[0][1] if self.outstanding else self.last_listed
+        if start_after is None:
+            return
+        tmp_fname = f"{LISTING_CHECKPOINT_FILE}.tmp"
+        with open(tmp_fname, "w") as f:
+            json.dump({"bucket": self.source_bucket, "prefix": self.prefix, "start_after": start_after}, f)
+        os.replace(tmp_fname, LISTING_CHECKPOINT_FILE)
+
+    def clear(self):
+        """Removes the checkpoint once the whole listing has been handled."""
+        if os.path.exists(LISTING_CHECKPOINT_FILE):
+            os.remove(LISTING_CHECKPOINT_FILE)
+
+def prefetch_pages(pages):
+    """Yields listing pages while the next page is already being fetched in a background thread."""
+    iterator = iter(pages)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(next, iterator, None)
+        while True:
+            page = future.result()
+            if page is None:
+                return
+            future = executor.submit(next, iterator, None)
+            yield page
+
+def multipart_copy(s3, source_bucket, destination_bucket, key, size, keyprotect_crn, request):
+    """Copies an object above the CopyObject size limit in place with UploadPartCopy, one part after another."""
+    create_kwargs = dict(Bucket=destination_bucket, Key=key)
+    if keyprotect_crn:
+        create_kwargs["ServerSideEncryption"] = "ibm-kms"
+        create_kwargs["SSEKMSKeyId"] = keyprotect_crn
+    upload_id = request(s3.create_multipart_upload, **create_kwargs)["UploadId"]
+
+    part_size = max(MULTIPART_COPY_PART_SIZE, -(-size // MAX_UPLOAD_PARTS))
+    parts = []
+    try:
+        for number, start in enumerate(range(0, size, part_size), 1):
+            end = min(start + part_size, size) - 1
+            result = request(
+                s3.upload_part_copy,
                 Bucket=destination_bucket,
                 Key=key,
-                MetadataDirective="REPLACE"
+                UploadId=upload_id,
+                PartNumber=number,
+                CopySource={'Bucket': source_bucket, 'Key': key},
+                CopySourceRange=f"bytes={start}-{end}"
             )
-            if keyprotect_crn:
-                kwargs["ServerSideEncryption"] = "ibm-kms"
-                kwargs["SSEKMSKeyId"] = keyprotect_crn
-            s3.copy_object(**kwargs)
-
-        success = False
-        for attempt in range(1, max_retries + 1):
+            parts.append({"PartNumber": number, "ETag": result["CopyPartResult"]["ETag"]})
+        request(
+            s3.complete_multipart_upload,
+            Bucket=destination_bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+    except Exception:
+        try:
+            # Rate limited and retried like the other requests, so a throttled
+            # abort does not leave the uploaded parts behind
+            request(s3.abort_multipart_upload, Bucket=destination_bucket, Key=key, UploadId=upload_id)
+        except Exception as e:
+            logging.warning("Could not abort multipart copy of %s (upload %s): %s", key, upload_id, e)
+        raise
+
+def _copy_one(source_bucket, destination_bucket, key, keyprotect_crn, max_retries=MAX_RETRIES, size=None):
+    """Copies a single object in place. Returns (key, status, attempts, error) with status "copied", "archived" or "failed".
+
+    Objects larger than MULTIPART_COPY_THRESHOLD are copied in parts. If the
+    size is not known (retry mode), it is only looked up after CopyObject
+    rejects the object.
+    """
+    s3 = get_thread_s3_client()
+    kwargs = dict(
+        CopySource={'Bucket': source_bucket, 'Key': key},
+        Bucket=destination_bucket,
+        Key=key,
+        MetadataDirective="REPLACE"
+    )
+    if keyprotect_crn:
+        kwargs["ServerSideEncryption"] = "ibm-kms"
+        kwargs["SSEKMSKeyId"] = keyprotect_crn
+
+    attempts = 0
+    rate_limiter = get_rate_limiter()
+
+    def copy_object():
+        nonlocal attempts
+        attempts += 1
+        rate_limiter.acquire()
+        s3.copy_object(**kwargs)
+
+    def request(operation, **params):
+        """Runs one request of a multipart copy with rate limiting and backoff."""
+        def call():
+            rate_limiter.acquire()
+            return operation(**params)
+        return retry_with_backoff(call, max_retries=max_retries)
+
+    try:
+        if size is not None and size > MULTIPART_COPY_THRESHOLD:
+            attempts = 1
+            multipart_copy(s3, source_bucket, destination_bucket, key, size, keyprotect_crn, request)
+        else:
             try:
-                retry_with_backoff(lambda: throttle(copy_object))
-                tqdm.write(f"{CHECK_ICON} [{batch_number}] {key} moved to archive successfully (attempt {attempt}).")
-                logging.info(f"[{batch_number}] {key} moved to archive successfully (attempt {attempt})")
-                save_copied_key(key)
-                remove_key_from_failed_keys(key)  
-                successful_copies += 1
-                success = True
-                break
-            except Exception as e:
-                error_message = str(e)
-                if "InvalidObjectState" in error_message and "Operation is not valid for the source object's storage class" in error_message:
-                    tqdm.write(f"{CHECK_ICON} [{batch_number}] {key} already archived or in archive tier (treated as success).")
-                    logging.info(f"[{batch_number}] {key} already archived or in archive tier (treated as success).")
-                    save_copied_key(key)
-                    remove_key_from_failed_keys(key)
-                    successful_copies += 1
-                    success = True
-                    break
-                else:
-                    tqdm.write(f"{ERROR_ICON} [{batch_number}] Error moving {key} to archive (attempt {attempt}): {e}")
-                    logging.warning(f"[{batch_number}] Error moving {key} to archive (attempt {attempt}): {e}")
-
-        if not success:
-            save_failed_key(key)
+                retry_with_backoff(copy_object, max_retries=max_retries)
+            except ClientError as e:
+                if size is not None or e.response.get("Error", {}).get("Code") not in TOO_LARGE_ERROR_CODES:
+                    raise
+                size = request(s3.head_object, Bucket=source_bucket, Key=key)["ContentLength"]
+                if size <= MULTIPART_COPY_THRESHOLD:
+                    raise
+                multipart_copy(s3, source_bucket, destination_bucket, key, size, keyprotect_crn, request)
+        return key, "copied", attempts, None
+    except Exception as e:
+        if is_archived_error(e):
+            return key, "archived", attempts, None
+        return key, "failed", attempts, e
+
+def copy_keys_concurrently(source_bucket, destination_bucket, objects, max_retries=MAX_RETRIES):
+    """Copies (key, size) pairs from any iterable on the shared copy workers and yields (key, status, attempts, error) as each copy finishes.
+
+    The size may be None if it is not known. Objects are pulled from the
+    iterable only while fewer than MAX_PENDING_COPIES copies are pending, so a
+    lazily listed bucket streams straight into the workers without buffering.
+    """
+    keyprotect_crn = os.environ.get("KEY_PROTECT_CRN")
+    executor = get_copy_executor()
+    max_pending = max(MAX_PENDING_COPIES, 2 * COPY_WORKERS)
+    pending = set()
+    for key, size in objects:
+        pending.add(executor.submit(_copy_one, source_bucket, destination_bucket, key, keyprotect_crn, max_retries, size))
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in as_completed(pending):
+        yield future.result()
+
+def record_copy_result(key, status, attempt, error, batch_number):
+    """Logs the result of one copy and saves the key as copied or failed. Returns True on success."""
+    if status == "copied":
+        if VERBOSE:
+            tqdm.write(f"{CHECK_ICON} [{batch_number}] {key} moved to archive successfully (attempt {attempt}).")
+        logging.debug("[%s] %s moved to archive successfully (attempt %s)", batch_number, key, attempt)
+    elif status == "archived":
+        if VERBOSE:
+            tqdm.write(f"{CHECK_ICON} [{batch_number}] {key} already archived or in archive tier (treated as success).")
+        logging.debug("[%s] %s already archived or in archive tier (treated as success).", batch_number, key)
+    else:
+        tqdm.write(f"{ERROR_ICON} [{batch_number}] Error moving {key} to archive (attempt {attempt}): {error}")
+        logging.warning("[%s] Error moving %s to archive (attempt %s): %s", batch_number, key, attempt, error)
+        save_failed_key(key)
+        return False
 
-    return successful_copies
+    save_copied_key(key)
+    return True
 
 def copy_objects_in_batches(source_bucket, destination_bucket, batch_size=BATCH_SIZE):
-    s3 = client(
-        's3',
-        ibm_api_key_id=os.environ['IAM_API_KEY'],
-        config=Config(signature_version='oauth'),
-        endpoint_url=f"https://s3.{os.environ['REGION']}.cloud-object-storage.appdomain.cloud"
-    )
+    s3 = get_s3_client()
 
-    copied_keys = load_copied_keys()
+    # Listed keys are checked against the sorted copied keys file, so only
+    # recent and newly archived keys are held in memory
+    previously_copied = open_copied_keys()
+    copied_keys = set()
     prefix = os.environ.get("OBJECT_PREFIX", "").strip()
-    total_keys = count_total_keys(s3, source_bucket, prefix=prefix)
-    total_to_process = total_keys - len(copied_keys)
-
-    if total_to_process <= 0:
-        tqdm.write(f"{CHECK_ICON} All files have already been processed.")
-        return
-
-    tqdm.write(f"{INFO_ICON} Total files to process: {total_to_process}")
 
+    # The bucket is listed only once: totals are counted while the pages arrive
     paginator = s3.get_paginator('list_objects_v2')
-    batch = []
-    batch_number = 1
     processed = 0
     failed = 0
+    total_keys = 0
+    total_to_process = 0
 
-    paginate_kwargs = {"Bucket": source_bucket}
+    paginate_kwargs = {"Bucket": source_bucket, "PaginationConfig": {"PageSize": LIST_PAGE_SIZE}}
     if prefix:
         paginate_kwargs["Prefix"] = prefix
 
-    def format_eta(seconds):
-        """Format seconds as hh:mm:ss."""
-        return str(timedelta(seconds=int(seconds)))
-
+    # An aborted run left a checkpoint: skip the part of the listing it already handled
+    checkpoint = ListingCheckpoint(source_bucket, prefix)
+    start_after = checkpoint.load()
+    if start_after is not None:
+        paginate_kwargs["StartAfter"] = start_after
+        tqdm.write(f"{INFO_ICON} Resuming the listing after {start_after}")
+        logging.info("Resuming the listing after %s", start_after)
+
+    def keys_to_process():
+        """Yields (key, size) of the listed objects that are not archived yet, updating the totals page by page."""
+        nonlocal total_keys, total_to_process, processed
+        for page in prefetch_pages(paginator.paginate(**paginate_kwargs)):
+            contents = page.get('Contents', [])
+            total_keys += len(contents)
+            new_objects = []
+            archived = 0
+            for obj in contents:
+                key = obj['Key']
+                if key in previously_copied:
+                    continue
+                # The listing already tells which objects are in the archive
+                # tier, so they are recorded without a CopyObject round trip
+                if obj.get('StorageClass') in ARCHIVE_STORAGE_CLASSES:
+                    save_copied_key(key)
+                    copied_keys.add(key)
+                    archived += 1
+                else:
+                    new_objects.append((key, obj.get('Size')))
+            if new_objects or archived:
+                total_to_process += len(new_objects) + archived
+                processed += archived
+                pbar.total = total_to_process
+                pbar.update(archived)
+                pbar.refresh()
+            # The whole page is recorded up front; its new keys stay outstanding
+            # until their copies finish
+            new_keys = {key for key, _ in new_objects}
+            for obj in contents:
+                checkpoint.listed(obj['Key'], obj['Key'] in new_keys)
+            yield from new_objects
+
+    def finish_batch():
+        """Writes out the buffered keys and the listing checkpoint and logs a progress summary."""
+        flush_copied_keys()
+        flush_failed_keys()
+        checkpoint.save()
+        logging.info("Progress: %s archived, %s failed, %s listed to process", processed, failed, total_to_process)
+
+    # Listing streams straight into the copy workers; a batch is now only the
+    # unit for writing out keys
     with tqdm(
-        total=total_to_process,
+        total=None,
         desc=f"{INFO_ICON} Processing",
         unit="obj",
         dynamic_ncols=True,
-        bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}, ETA: {postfix}]"
+        bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]"
     ) as pbar:
-        for page in paginator.paginate(**paginate_kwargs):
-            for obj in page.get('Contents', []):
-                key = obj['Key']
-                if key in copied_keys:
-                    continue
+        results = copy_keys_concurrently(source_bucket, destination_bucket, keys_to_process())
+        for done, (key, status, attempt, error) in enumerate(results, 1):
+            batch_number = (done - 1) // batch_size + 1
+            checkpoint.done(key)
+            if record_copy_result(key, status, attempt, error, batch_number):
+                copied_keys.add(key)
+                processed += 1
+                pbar.update(1)
+            else:
+                failed += 1
+            if done % batch_size == 0:
+                finish_batch()
+        finish_batch()
+    checkpoint.clear()
+
+    copied_keys_total = previously_copied.close() + len(copied_keys)
 
-                batch.append(key)
-
-                if len(batch) >= batch_size:
-                    tqdm.write(f"{INFO_ICON} Processing batch {batch_number} with {len(batch)} objects...")
-                    successful = process_batch(s3, source_bucket, destination_bucket, batch, batch_number, copied_keys)
-                    processed += successful
-                    failed += (batch_size - successful)
-                    batch = []
-                    batch_number += 1
-                    # ETA calculation
-                    if pbar.n > 0:
-                        rate = pbar.n / pbar.format_dict['elapsed']
-                        remaining = (pbar.total - pbar.n) / rate if rate > 0 else 0
-                        pbar.set_postfix_str(format_eta(remaining))
-                    pbar.update(successful)
-
-        # Process the last batch
-        if batch:
-            tqdm.write(f"{INFO_ICON} Processing last batch {batch_number} with {len(batch)} objects...")
-            successful = process_batch(s3, source_bucket, destination_bucket, batch, batch_number, copied_keys)
-            processed += successful
-            failed += (len(batch) - successful)
-            if pbar.n > 0:
-                rate = pbar.n / pbar.format_dict['elapsed']
-                remaining = (pbar.total - pbar.n) / rate if rate > 0 else 0
-                pbar.set_postfix_str(format_eta(remaining))
-            pbar.update(successful)
+    if total_to_process == 0:
+        tqdm.write(f"{CHECK_ICON} All files have already been processed.")
+        return
 
     tqdm.write(f"{CHECK_ICON} Processing complete. Successfully processed: {processed} of {total_to_process}")
     tqdm.write(f"{ERROR_ICON} {failed} of {total_to_process} objects failed")
     logging.info(f"Processing complete. Successfully processed: {processed} of {total_to_process}")
     logging.info(f"Failed objects: {failed} of {total_to_process}")
 
+    # Drop the keys archived in this run from the failed_keys files in a single pass
+    remove_keys_from_failed_keys(copied_keys)
+
     # Show absolute stats: all copied keys vs. all keys in bucket
-    copied_keys_total = len(load_copied_keys())
-    tqdm.write(f"{CHECK_ICON} Total archived keys: {copied_keys_total} of {total_keys} in bucket.")
+    if start_after is not None:
+        # The part of the bucket before the checkpoint was not listed again
+        tqdm.write(f"{CHECK_ICON} Total archived keys: {copied_keys_total}.")
+    else:
+        tqdm.write(f"{CHECK_ICON} Total archived keys: {copied_keys_total} of {total_keys} in bucket.")
 
 def retry_failed_keys(source_bucket, destination_bucket, max_retries=MAX_RETRIES):
-    s3 = client(
-        's3',
-        ibm_api_key_id=os.environ['IAM_API_KEY'],
-        config=Config(signature_version='oauth'),
-        endpoint_url=f"https://s3.{os.environ['REGION']}.cloud-object-storage.appdomain.cloud"
-    )
-
-    keyprotect_crn = os.environ.get("KEY_PROTECT_CRN")  #
-
     prefix = os.environ.get("OBJECT_PREFIX", "").strip()
     failed_keys = load_failed_keys()
     if prefix:
@@ -334,74 +820,43 @@ def retry_failed_keys(source_bucket, destination_bucket, max_retries=MAX_RETRIES
         tqdm.write(f"{MAIL_ICON} No failed keys present.")
         return
 
-    copied_keys = load_copied_keys()
+    # Failed keys are retried in ascending order so they can be checked
+    # against the sorted copied keys file
+    failed_keys.sort()
+    copied_keys = open_copied_keys()
     remaining_keys = []
     total = len(failed_keys)
 
     tqdm.write(f"{RETRY_ICON} Retrying {total} failed objects...")
 
     with tqdm(total=total, desc=f"{RETRY_ICON} Retry", unit="obj") as pbar:
-        for key in failed_keys:
-            if key in copied_keys:
-                pbar.update(1)
-                continue
-
-            copy_source = {
-                'Bucket': source_bucket,
-                'Key': key
-            }
-
-            success = False
-            for attempt in range(1, max_retries + 1):
-                try:
-                    kwargs = dict(
-                        CopySource=copy_source,
-                        Bucket=destination_bucket,
-                        Key=key,
-                        MetadataDirective="REPLACE"
-                    )
-                    if keyprotect_crn:
-                        kwargs["ServerSideEncryption"] = "ibm-kms"
-                        kwargs["SSEKMSKeyId"] = keyprotect_crn
-                    s3.copy_object(**kwargs)
+        pending_keys = [key for key in failed_keys if key not in copied_keys]
+        pbar.update(total - len(pending_keys))
+
+        for key, status, attempt, error in copy_keys_concurrently(source_bucket, destination_bucket, ((key, None) for key in pending_keys), max_retries):
+            if status == "copied":
+                if VERBOSE:
                     tqdm.write(f"{CHECK_ICON} RETRY: {key} moved to archive successfully (attempt {attempt})")
-                    logging.info(f"RETRY: {key} moved to archive successfully (attempt {attempt})")
-                    save_copied_key(key)
-                    remove_key_from_failed_keys(key)  
-                    success = True
-                    break
-                except Exception as e:
-                    error_message = str(e)
-                    if "InvalidObjectState" in error_message and "Operation is not valid for the source object's storage class" in error_message:
-                        tqdm.write(f"{CHECK_ICON} RETRY: {key} already archived or in archive tier.")
-                        logging.info(f"RETRY: {key} already archived or in archive tier (treated as success).")
-                        save_copied_key(key)
-                        remove_key_from_failed_keys(key)
-                        success = True
-                        break
-                    else:
-                        tqdm.write(f"{ERROR_ICON} RETRY error moving {key} to archive (attempt {attempt}): {e}")
-                        logging.warning(f"RETRY: Error moving {key} to archive (attempt {attempt}): {e}")
-
-            if not success:
+                logging.debug("RETRY: %s moved to archive successfully (attempt %s)", key, attempt)
+                save_copied_key(key)
+            elif status == "archived":
+                if VERBOSE:
+                    tqdm.write(f"{CHECK_ICON} RETRY: {key} already archived or in archive tier.")
+                logging.debug("RETRY: %s already archived or in archive tier (treated as success).", key)
+                save_copied_key(key)
+            else:
+                tqdm.write(f"{ERROR_ICON} RETRY error moving {key} to archive (attempt {attempt}): {error}")
+                logging.warning("RETRY: Error moving %s to archive (attempt %s): %s", key, attempt, error)
                 remaining_keys.append(key)
 
             pbar.update(1)
 
-    # Write remaining failed keys to new file(s)
-    # We also rotate here if > MAX_KEYS_PER_FILE
-    idx = 1
-    written = 0
-    if remaining_keys:
-        for i in range(0, len(remaining_keys), MAX_KEYS_PER_FILE):
-            fname = f"{FAILED_KEYS_PREFIX}_{idx}.txt"
-            with open(fname, "w") as f:
-                for key in remaining_keys[i:i+MAX_KEYS_PER_FILE]:
-                    f.write(f"{key}\n")
-            idx += 1
-            written += len(remaining_keys[i:i+MAX_KEYS_PER_FILE])
-    else:
-        clear_failed_keys()
+    copied_keys.close()
+    flush_copied_keys()
+
+    # Sweep every key that is archived now out of the failed keys files.
+    # Keys outside OBJECT_PREFIX and keys that failed again stay where they are.
+    remove_keys_from_failed_keys(set(failed_keys).difference(remaining_keys))
 
     tqdm.write(f"{RETRY_ICON} Retry complete. Still remaining: {len(remaining_keys)}")
     logging.info(f"Retry complete. Remaining errors: {len(remaining_keys)}")
@@ -409,17 +864,25 @@ def retry_failed_keys(source_bucket, destination_bucket, max_retries=MAX_RETRIES
 
 
 # Remove successfully copied keys from failed_keys files
-def remove_key_from_failed_keys(key):
-    """Remove a key from all failed_keys files if it was successfully archived."""
+def remove_keys_from_failed_keys(keys):
+    """Remove all given keys from the failed_keys files, streaming each file once into a temp file that replaces it."""
+    if not keys:
+        return
+    # The files are replaced, so the writer must not keep appending to the old ones
+    close_failed_keys()
     for fname in glob.glob(f"{FAILED_KEYS_PREFIX}_*.txt"):
-        if not os.path.exists(fname):
-            continue
-        with open(fname, "r") as f:
-            lines = f.readlines()
-        new_lines = [line for line in lines if line.strip() != key]
-        if len(new_lines) != len(lines):
-            with open(fname, "w") as f:
-                f.writelines(new_lines)
+        tmp_fname = f"{fname}.tmp"
+        removed = False
+        with open(fname, "r") as src, open(tmp_fname, "w", buffering=KEY_FILE_BUFFER_SIZE) as dst:
+            for line in src:
+                if line.rstrip("\n") in keys:
+                    removed = True
+                else:
+                    dst.write(line)
+        if removed:
+            os.replace(tmp_fname, fname)
+        else:
+            os.remove(tmp_fname)
 
 
 
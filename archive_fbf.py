@@ -1,21 +1,42 @@
 import time
-from ibm_boto3 import client
+import atexit
+import random
+import re
+import signal
+import sys
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from ibm_boto3.session import Session
 from ibm_botocore.client import Config
+from ibm_botocore.exceptions import ClientError
 import os
 from dotenv import load_dotenv
 import logging
 from tqdm import tqdm
 import glob
+import json
 from datetime import timedelta
 
 # --- Control Plane: All configurable parameters in one place ---
 
 MAX_KEYS_PER_FILE = 250            # Max lines per key file before rotating
-BATCH_SIZE = 100                   # Number of objects per batch
+KEY_FILE_BUFFER_SIZE = 1 << 16     # I/O buffer (in bytes) of the key files
+BATCH_SIZE = 100                   # Number of finished copies between writing out keys
+ETA_UPDATE_INTERVAL = 1.0          # Min seconds between recomputing the ETA of the progress bar
+MAX_PENDING_COPIES = 400           # Max copies submitted to the workers but not finished yet (at least 2x the workers)
 MAX_RETRIES = 3                    # Max retries for copy operations
 BACKOFF_FACTOR = 2                 # Exponential backoff factor
-THROTTLE_DELAY = 0.1               # Delay (in seconds) between API calls
+MAX_REQUESTS_PER_SECOND = 3000     # Client-side copy rate limit (override with COS_MAX_RPS in .env)
+RATE_LIMIT_BURST = 100             # Max number of requests allowed in a single burst
 USE_EMOJIS = True                  # Emoji output in logs
+VERBOSE = False                    # Console and log line for every archived object (errors are always reported)
+MAX_WORKERS = 64                   # Number of parallel copy threads (override with COS_MAX_WORKERS in .env)
+LISTING_WORKERS = 32               # Number of parallel listing threads while building structure.txt
+MAX_POOL_CONNECTIONS = 32          # HTTP connection pool size of the shared listing client
+WORKER_POOL_CONNECTIONS = 2        # HTTP connection pool size of each copy/listing thread's own client
+CONNECT_TIMEOUT = 5                # Seconds to wait for a new connection to COS
+READ_TIMEOUT = 120                 # Seconds to wait for a response (large objects take a while to copy)
 
 COPIED_KEYS_DIR = "copied_keys"
 FAILED_KEYS_DIR = "failed_keys"
@@ -28,6 +49,7 @@ os.makedirs(LOG_DIR, exist_ok=True)
 COPIED_KEYS_PREFIX = os.path.join(COPIED_KEYS_DIR, "copied_keys")
 FAILED_KEYS_PREFIX = os.path.join(FAILED_KEYS_DIR, "failed_keys")
 LOG_FILE = os.path.join(LOG_DIR, "cos_batch_copy.log")
+LISTING_CHECKPOINT_FILE = os.path.join(COPIED_KEYS_DIR, "listing_checkpoint.json")
 ENV_FILE_PATH = os.path.join(os.path.dirname(__file__), ".env")
 
 # --- Input Handling ---
@@ -92,7 +114,7 @@ def ensure_env():
 
 logging.basicConfig(
     filename=LOG_FILE,
-    level=logging.INFO,
+    level=logging.DEBUG if VERBOSE else logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
@@ -108,153 +130,405 @@ RETRY_ICON = get_icon("♻️", "[RETRY]")
 INFO_ICON = get_icon("🔄", "[INFO]")
 MAIL_ICON = get_icon("📭", "[NO FAILED KEYS]")
 
-def retry_with_backoff(func, max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR):
-    """Executes a function with exponential backoff."""
-    for attempt in range(1, max_retries + 1):
-        try:
-            return func()
-        except Exception as e:
-            if attempt == max_retries:
-                raise
-            time.sleep(backoff_factor ** attempt)
-
-def throttle(api_call, delay=THROTTLE_DELAY):
-    """Throttles API calls."""
-    time.sleep(delay)
-    return api_call()
+def backoff(attempt, backoff_factor=BACKOFF_FACTOR):
+    """Sleeps before the next attempt after a failed one (exponential, with a little jitter so the workers don't retry in lockstep)."""
+    time.sleep(backoff_factor ** attempt + random.random() * 0.1)
+
+def is_invalid_object_state(error):
+    """True if COS refused the copy because of the source object's storage class, i.e. the object is already archived."""
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") == "InvalidObjectState"
+
+class TokenBucket:
+    """Thread-safe token bucket that limits the request rate across all copy workers."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+RATE_LIMITER = None
+RATE_LIMITER_LOCK = threading.Lock()
+
+def get_rate_limiter():
+    """Returns the shared token bucket, created on first use so that COS_MAX_RPS from the .env file is honored."""
+    global RATE_LIMITER
+    with RATE_LIMITER_LOCK:
+        if RATE_LIMITER is None:
+            rate = float(os.environ.get("COS_MAX_RPS", MAX_REQUESTS_PER_SECOND))
+            RATE_LIMITER = TokenBucket(rate=rate, capacity=RATE_LIMIT_BURST)
+    return RATE_LIMITER
 
 # --- Key handling with file rotation ---
 
+def read_keys(fname):
+    """Returns the keys of a key file, split in one pass over the whole file instead of line by line."""
+    with open(fname, "r") as f:
+        return [key for key in f.read().split("\n") if key]
+
 def load_all_keys(prefix):
-    files = sorted(glob.glob(f"{prefix}_*.txt"))
     keys = set()
-    for fname in files:
-        with open(fname, "r") as f:
-            keys.update(line.strip() for line in f)
+    for fname in glob.glob(f"{prefix}_*.txt"):
+        keys.update(read_keys(fname))
     return keys
 
+KEY_FILE_INDEX = re.compile(r"_(\d+)\.txt$")
+
+def file_index(fname):
+    """Returns the rotation index N of a <prefix>_N.txt key file."""
+    return int(KEY_FILE_INDEX.search(fname).group(1))
+
 def get_current_file(prefix):
-    files = sorted(glob.glob(f"{prefix}_*.txt"))
-    if not files:
-        return f"{prefix}_1.txt"
-    return files[-1]
-
-def save_key(key, prefix):
-    fname = get_current_file(prefix)
-    # Check line count
-    if os.path.exists(fname):
-        with open(fname, "r") as f:
-            lines = sum(1 for _ in f)
-    else:
-        lines = 0
-    if lines >= MAX_KEYS_PER_FILE:
-        idx = int(fname.split('_')[-1].split('.')[0]) + 1
-        fname = f"{prefix}_{idx}.txt"
-    with open(fname, "a") as f:
-        f.write(f"{key}\n")
+    """Returns the key file with the highest rotation index (compared as numbers, so _10 comes after _9)."""
+    directory, base = os.path.split(prefix)
+    max_idx = 1
+    with os.scandir(directory or ".") as entries:
+        for entry in entries:
+            match = KEY_FILE_INDEX.search(entry.name)
+            if match and entry.name[:match.start()] == base:
+                max_idx = max(max_idx, int(match.group(1)))
+    return f"{prefix}_{max_idx}.txt"
+
+def count_lines(fname):
+    """Returns the number of lines in a file, or 0 if it does not exist."""
+    if not os.path.exists(fname):
+        return 0
+    with open(fname, "r") as f:
+        return sum(1 for _ in f)
+
+class KeyWriter:
+    """Appends keys to rotated key files through one persistent, buffered file handle.
+
+    The current file and its line count are only looked up on disk when the
+    handle is (re)opened, so writing a key is an in-memory append.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.file = None
+        self.index = None
+        self.lines = 0
+        self.lock = threading.Lock()
+
+    def _open(self):
+        """Opens the key file for appending: the next one after a rotation, otherwise the current one on disk."""
+        if self.index is not None:
+            self.index += 1
+            lines = 0
+        else:
+            fname = get_current_file(self.prefix)
+            self.index = file_index(fname)
+            lines = count_lines(fname)
+            if lines >= MAX_KEYS_PER_FILE:
+                self.index += 1
+                lines = 0
+        self.file = open(f"{self.prefix}_{self.index}.txt", "a", buffering=KEY_FILE_BUFFER_SIZE)
+        self.lines = lines
+
+    def write(self, keys):
+        """Appends keys, moving to the next file every MAX_KEYS_PER_FILE lines."""
+        with self.lock:
+            pos = 0
+            while pos < len(keys):
+                if self.file is not None and self.lines >= MAX_KEYS_PER_FILE:
+                    self.file.close()
+                    self.file = None
+                if self.file is None:
+                    self._open()
+                chunk = keys[pos:pos + MAX_KEYS_PER_FILE - self.lines]
+                self.file.write("".join(f"{key}\n" for key in chunk))
+                self.lines += len(chunk)
+                pos += len(chunk)
+
+    def flush(self):
+        """Writes buffered keys to disk."""
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        """Flushes and closes the current file. The next write looks up the current file on disk again."""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.index = None
+
+COPIED_KEYS_WRITER = KeyWriter(COPIED_KEYS_PREFIX)
+FAILED_KEYS_WRITER = KeyWriter(FAILED_KEYS_PREFIX)
+# All copied keys, read from the files once and kept up to date by save_copied_keys
+COPIED_KEYS = None
+# Number of copied keys below each folder ("a/" and "a/b/" both count "a/b/c.txt")
+ARCHIVED_BY_PREFIX = defaultdict(int)
+
+def count_key_in_prefixes(key):
+    """Counts a newly copied key for every folder it is in."""
+    end = key.find("/")
+    while end != -1:
+        ARCHIVED_BY_PREFIX[key[:end + 1]] += 1
+        end = key.find("/", end + 1)
 
 def load_copied_keys():
-    return load_all_keys(COPIED_KEYS_PREFIX)
+    """Returns the set of all copied keys. The files are only read on the first call."""
+    global COPIED_KEYS
+    if COPIED_KEYS is None:
+        COPIED_KEYS = load_all_keys(COPIED_KEYS_PREFIX)
+        for key in COPIED_KEYS:
+            count_key_in_prefixes(key)
+    return COPIED_KEYS
+
+def save_copied_keys(keys):
+    copied_keys = load_copied_keys()
+    for key in keys:
+        if key not in copied_keys:
+            copied_keys.add(key)
+            count_key_in_prefixes(key)
+    COPIED_KEYS_WRITER.write(keys)
 
 def save_copied_key(key):
-    save_key(key, COPIED_KEYS_PREFIX)
+    save_copied_keys([key])
+
+def flush_copied_keys():
+    """Writes buffered copied keys to disk."""
+    COPIED_KEYS_WRITER.flush()
+
+def close_copied_keys():
+    """Flushes and closes the copied keys file."""
+    COPIED_KEYS_WRITER.close()
+
+atexit.register(close_copied_keys)
 
 def load_failed_keys():
-    return list(load_all_keys(FAILED_KEYS_PREFIX))
+    """Returns the failed keys, except those archived since (see remove_key_from_failed_keys)."""
+    flush_failed_keys()
+    return list(load_all_keys(FAILED_KEYS_PREFIX) - FAILED_TOMBSTONES)
+
+def save_failed_keys(keys):
+    # A key that fails again is no longer tombstoned
+    FAILED_TOMBSTONES.difference_update(keys)
+    FAILED_KEYS_WRITER.write(keys)
 
 def save_failed_key(key):
-    save_key(key, FAILED_KEYS_PREFIX)
+    save_failed_keys([key])
 
-def clear_failed_keys():
-    for fname in glob.glob(f"{FAILED_KEYS_PREFIX}_*.txt"):
-        open(fname, "w").close()
+def flush_failed_keys():
+    """Writes buffered failed keys to disk."""
+    FAILED_KEYS_WRITER.flush()
 
-def count_total_keys(s3, bucket, prefix=""):
-    total = 0
-    paginator = s3.get_paginator('list_objects_v2')
-    paginate_kwargs = {"Bucket": bucket}
-    if prefix:
-        paginate_kwargs["Prefix"] = prefix
-    for page in paginator.paginate(**paginate_kwargs):
-        total += len(page.get('Contents', []))
-    return total
+def close_failed_keys():
+    """Flushes and closes the failed keys file."""
+    FAILED_KEYS_WRITER.close()
 
-def process_batch(s3, source_bucket, destination_bucket, batch, batch_number, copied_keys, max_retries=MAX_RETRIES):
-    successful_copies = 0
-    keyprotect_crn = os.environ.get("KEY_PROTECT_CRN")
-    for key in batch:
-        if key in copied_keys:
-            continue
-
-        copy_source = {
-            'Bucket': source_bucket,
-            'Key': key
-        }
-
-        def copy_object():
-            kwargs = dict(
-                CopySource=copy_source,
-                Bucket=destination_bucket,
-                Key=key,
-                MetadataDirective="REPLACE"
-            )
-            if keyprotect_crn:
-                kwargs["ServerSideEncryption"] = "ibm-kms"
-                kwargs["SSEKMSKeyId"] = keyprotect_crn
-            s3.copy_object(**kwargs)
-
-        success = False
-        for attempt in range(1, max_retries + 1):
-            try:
-                retry_with_backoff(lambda: throttle(copy_object))
-                tqdm.write(f"{CHECK_ICON} [{batch_number}] {key} moved to archive successfully (attempt {attempt}).")
-                logging.info(f"[{batch_number}] {key} moved to archive successfully (attempt {attempt})")
-                save_copied_key(key)
-                remove_key_from_failed_keys(key)  
-                successful_copies += 1
-                success = True
-                break
-            except Exception as e:
-                error_message = str(e)
-                if "InvalidObjectState" in error_message and "Operation is not valid for the source object's storage class" in error_message:
-                    tqdm.write(f"{CHECK_ICON} [{batch_number}] {key} already archived or in archive tier (treated as success).")
-                    logging.info(f"[{batch_number}] {key} already archived or in archive tier (treated as success).")
-                    save_copied_key(key)
-                    remove_key_from_failed_keys(key)
-                    successful_copies += 1
-                    success = True
-                    break
-                else:
-                    tqdm.write(f"{ERROR_ICON} [{batch_number}] Error moving {key} to archive (attempt {attempt}): {e}")
-                    logging.warning(f"[{batch_number}] Error moving {key} to archive (attempt {attempt}): {e}")
+atexit.register(close_failed_keys)
 
-        if not success:
-            save_failed_key(key)
+def _exit_on_sigterm(signum, frame):
+    """Turns SIGTERM into a normal exit so the atexit handlers write out all buffered keys."""
+    sys.exit(128 + signum)
 
-    return successful_copies
+signal.signal(signal.SIGTERM, _exit_on_sigterm)
 
-def copy_objects_in_batches(source_bucket, destination_bucket, batch_size=BATCH_SIZE):
-    s3 = client(
+# --- Parallel copies ---
+
+THREAD_LOCAL = threading.local()
+COPY_EXECUTOR = None
+COPY_WORKERS = MAX_WORKERS
+S3_CLIENT = None
+
+def create_s3_client(max_pool_connections=MAX_POOL_CONNECTIONS):
+    """Creates an S3 client on its own session (a session must not be shared between threads while creating clients)."""
+    return Session().client(
         's3',
         ibm_api_key_id=os.environ['IAM_API_KEY'],
-        config=Config(signature_version='oauth'),
+        config=Config(
+            signature_version='oauth',
+            max_pool_connections=max_pool_connections,
+            # The copy loops count and back off their own attempts
+            retries={'max_attempts': 0},
+            # Keep idle pooled connections alive so TLS sessions are reused
+            tcp_keepalive=True,
+            connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=READ_TIMEOUT
+        ),
         endpoint_url=f"https://s3.{os.environ['REGION']}.cloud-object-storage.appdomain.cloud"
     )
 
+def get_s3_client():
+    """Returns the client used for listing from the main thread, created once per run so its connections are reused across folders."""
+    global S3_CLIENT
+    if S3_CLIENT is None:
+        S3_CLIENT = create_s3_client()
+    return S3_CLIENT
+
+def get_thread_s3_client():
+    """Returns the S3 client of the calling worker thread, creating it on first use."""
+    s3 = getattr(THREAD_LOCAL, "s3", None)
+    if s3 is None:
+        s3 = THREAD_LOCAL.s3 = create_s3_client(max_pool_connections=WORKER_POOL_CONNECTIONS)
+    return s3
+
+def get_copy_executor():
+    """Returns the thread pool of copy workers. It lives for the whole run so the per-thread clients are reused."""
+    global COPY_EXECUTOR, COPY_WORKERS
+    if COPY_EXECUTOR is None:
+        COPY_WORKERS = int(os.environ.get("COS_MAX_WORKERS", MAX_WORKERS))
+        COPY_EXECUTOR = ThreadPoolExecutor(max_workers=COPY_WORKERS, thread_name_prefix="copy")
+    return COPY_EXECUTOR
+
+def copy_object_kwargs(destination_bucket):
+    """Returns the copy_object arguments shared by every key of a run (everything except CopySource and Key)."""
+    kwargs = {
+        "Bucket": destination_bucket,
+        "MetadataDirective": "REPLACE"
+    }
+    keyprotect_crn = os.environ.get("KEY_PROTECT_CRN")
+    if keyprotect_crn:
+        kwargs["ServerSideEncryption"] = "ibm-kms"
+        kwargs["SSEKMSKeyId"] = keyprotect_crn
+    return kwargs
+
+def _copy_one(source_bucket, key, copy_kwargs, label, max_retries=MAX_RETRIES):
+    """Copies a single object in place on the worker's own client. Returns (key, status, attempt, error) with status "copied", "archived" or "failed"."""
+    s3 = get_thread_s3_client()
+    rate_limiter = get_rate_limiter()
+
+    error = None
+    for attempt in range(1, max_retries + 1):
+        try:
+            rate_limiter.acquire()
+            s3.copy_object(CopySource={'Bucket': source_bucket, 'Key': key}, Key=key, **copy_kwargs)
+            return key, "copied", attempt, None
+        except Exception as e:
+            if is_invalid_object_state(e):
+                return key, "archived", attempt, None
+            # Only the log file here; a key that keeps failing is reported on
+            # the console once by the thread handling the results
+            logging.warning("%s Error moving %s to archive (attempt %s): %s", label, key, attempt, e)
+            error = e
+            if attempt < max_retries:
+                backoff(attempt)
+    return key, "failed", max_retries, error
+
+def copy_keys_concurrently(source_bucket, destination_bucket, keys, max_retries=MAX_RETRIES):
+    """Copies (key, label) pairs from any iterable on the shared copy workers and yields (key, status, attempt, error) as each copy finishes.
+
+    Keys are pulled from the iterable only while fewer than MAX_PENDING_COPIES
+    copies are pending, so a lazily listed folder streams straight into the
+    workers and the next page is listed while the copies are running.
+    """
+    copy_kwargs = copy_object_kwargs(destination_bucket)
+    executor = get_copy_executor()
+    max_pending = max(MAX_PENDING_COPIES, 2 * COPY_WORKERS)
+    pending = set()
+    for key, label in keys:
+        pending.add(executor.submit(_copy_one, source_bucket, key, copy_kwargs, label, max_retries))
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in as_completed(pending):
+        yield future.result()
+
+def log_copy_result(key, status, attempt, error, label):
+    """Logs the result of one copy. Successes are only logged with VERBOSE, failures always."""
+    if status == "copied":
+        if VERBOSE:
+            tqdm.write(f"{CHECK_ICON} {label} {key} moved to archive successfully (attempt {attempt}).")
+        logging.debug("%s %s moved to archive successfully (attempt %s)", label, key, attempt)
+    elif status == "archived":
+        if VERBOSE:
+            tqdm.write(f"{CHECK_ICON} {label} {key} already archived or in archive tier (treated as success).")
+        logging.debug("%s %s already archived or in archive tier (treated as success).", label, key)
+    else:
+        tqdm.write(f"{ERROR_ICON} {label} Error moving {key} to archive (attempt {attempt}): {error}")
+        logging.warning("%s Giving up on %s after %s attempts: %s", label, key, attempt, error)
+
+def save_batch_results(copied, failed):
+    """Writes the keys of a finished batch to the key files (only called from the main thread)."""
+    save_copied_keys(copied)
+    for key in copied:
+        remove_key_from_failed_keys(key)
+    save_failed_keys(failed)
+    flush_copied_keys()
+    flush_failed_keys()
+
+class ListingCheckpoint:
+    """Tracks the last listed key up to which every object has been handled, so an aborted run resumes the listing there.
+
+    Keys are listed in ascending order but copies finish out of order, so the
+    checkpoint only moves past a key once it and all keys before it are done.
+    """
+
+    def __init__(self, source_bucket, prefix):
+        self.source_bucket = source_bucket
+        self.prefix = prefix
+        self.last_listed = None
+        # (key, key listed before it) of submitted copies that have not finished in order yet
+        self.outstanding = deque()
+        self.finished = set()
+
+    def load(self):
+        """Returns the key to resume the listing after, or None to list from the start."""
+        if not os.path.exists(LISTING_CHECKPOINT_FILE):
+            return None
+        with open(LISTING_CHECKPOINT_FILE, "r") as f:
+            state = json.load(f)
+        if state.get("bucket") != self.source_bucket or state.get("prefix") != self.prefix:
+            return None
+        self.last_listed = state.get("start_after")
+        return self.last_listed
+
+    def listed(self, key, submitted):
+        """Records a listed key and whether a copy was submitted for it."""
+        if submitted:
+            self.outstanding.append((key, self.last_listed))
+        self.last_listed = key
+
+    def done(self, key):
+        """Records that the copy of key finished (successfully or not)."""
+        self.finished.add(key)
+        while self.outstanding and self.outstanding[0][0] in self.finished:
+            self.finished.discard(self.outstanding.popleft()[0])
+
+    def save(self):
+        """Writes the checkpoint. Call only after the copied and failed keys are flushed."""
+        start_after = self.outstanding[0][1] if self.outstanding else self.last_listed
+        if start_after is None:
+            return
+        tmp_fname = f"{LISTING_CHECKPOINT_FILE}.tmp"
+        with open(tmp_fname, "w") as f:
+            json.dump({"bucket": self.source_bucket, "prefix": self.prefix, "start_after": start_after}, f)
+        os.replace(tmp_fname, LISTING_CHECKPOINT_FILE)
+
+    def clear(self):
+        """Removes the checkpoint once the whole listing has been handled."""
+        if os.path.exists(LISTING_CHECKPOINT_FILE):
+            os.remove(LISTING_CHECKPOINT_FILE)
+
+def copy_objects_in_batches(source_bucket, destination_bucket, batch_size=BATCH_SIZE):
+    s3 = get_s3_client()
+
     copied_keys = load_copied_keys()
     prefix = os.environ.get("OBJECT_PREFIX", "").strip()
-    total_keys = count_total_keys(s3, source_bucket, prefix=prefix)
-    total_to_process = total_keys - len(copied_keys)
 
-    if total_to_process <= 0:
-        tqdm.write(f"{CHECK_ICON} All files have already been processed.")
-        return
-
-    tqdm.write(f"{INFO_ICON} Total files to process: {total_to_process}")
+    # The folder is listed only once: totals are counted while the pages arrive
+    total_keys = 0
+    total_to_process = 0
 
     paginator = s3.get_paginator('list_objects_v2')
-    batch = []
-    batch_number = 1
     processed = 0
     failed = 0
 
@@ -262,50 +536,87 @@ def copy_objects_in_batches(source_bucket, destination_bucket, batch_size=BATCH_
     if prefix:
         paginate_kwargs["Prefix"] = prefix
 
+    # An aborted run left a checkpoint: skip the part of the folder it already handled
+    checkpoint = ListingCheckpoint(source_bucket, prefix)
+    start_after = checkpoint.load()
+    if start_after is not None:
+        paginate_kwargs["StartAfter"] = start_after
+        tqdm.write(f"{INFO_ICON} Resuming the listing after {start_after}")
+        logging.info("Resuming the listing after %s", start_after)
+
     def format_eta(seconds):
         """Format seconds as hh:mm:ss."""
         return str(timedelta(seconds=int(seconds)))
 
+    last_eta_update = time.monotonic()
+
+    def update_eta():
+        """Recomputes the ETA at most every ETA_UPDATE_INTERVAL seconds."""
+        nonlocal last_eta_update
+        now = time.monotonic()
+        if now - last_eta_update < ETA_UPDATE_INTERVAL:
+            return
+        last_eta_update = now
+        if pbar.n > 0:
+            rate = pbar.n / pbar.format_dict['elapsed']
+            remaining = (pbar.total - pbar.n) / rate if rate > 0 else 0
+            pbar.set_postfix_str(format_eta(remaining))
+
+    def keys_to_process():
+        """Yields (key, batch label) of the listed objects that are not archived yet, updating the totals page by page."""
+        nonlocal total_keys, total_to_process
+        for page in paginator.paginate(**paginate_kwargs):
+            contents = page.get('Contents', [])
+            total_keys += len(contents)
+            new_keys = [obj['Key'] for obj in contents if obj['Key'] not in copied_keys]
+            if new_keys:
+                pbar.total = total_to_process + len(new_keys)
+                pbar.refresh()
+            # The whole page is recorded up front; its new keys stay outstanding
+            # until their copies finish
+            submitted = set(new_keys)
+            for obj in contents:
+                checkpoint.listed(obj['Key'], obj['Key'] in submitted)
+            for key in new_keys:
+                yield key, f"[{total_to_process // batch_size + 1}]"
+                total_to_process += 1
+
+    # Listing streams straight into the copy workers; a batch is now only the
+    # unit for writing out keys
+    batch_copied = []
+    batch_failed = []
     with tqdm(
-        total=total_to_process,
+        total=None,
         desc=f"{INFO_ICON} Processing",
         unit="obj",
         dynamic_ncols=True,
         bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}, ETA: {postfix}]"
     ) as pbar:
-        for page in paginator.paginate(**paginate_kwargs):
-            for obj in page.get('Contents', []):
-                key = obj['Key']
-                if key in copied_keys:
-                    continue
-
-                batch.append(key)
-
-                if len(batch) >= batch_size:
-                    tqdm.write(f"{INFO_ICON} Processing batch {batch_number} with {len(batch)} objects...")
-                    successful = process_batch(s3, source_bucket, destination_bucket, batch, batch_number, copied_keys)
-                    processed += successful
-                    failed += (batch_size - successful)
-                    batch = []
-                    batch_number += 1
-                    # ETA calculation
-                    if pbar.n > 0:
-                        rate = pbar.n / pbar.format_dict['elapsed']
-                        remaining = (pbar.total - pbar.n) / rate if rate > 0 else 0
-                        pbar.set_postfix_str(format_eta(remaining))
-                    pbar.update(successful)
-
-        # Process the last batch
-        if batch:
-            tqdm.write(f"{INFO_ICON} Processing last batch {batch_number} with {len(batch)} objects...")
-            successful = process_batch(s3, source_bucket, destination_bucket, batch, batch_number, copied_keys)
-            processed += successful
-            failed += (len(batch) - successful)
-            if pbar.n > 0:
-                rate = pbar.n / pbar.format_dict['elapsed']
-                remaining = (pbar.total - pbar.n) / rate if rate > 0 else 0
-                pbar.set_postfix_str(format_eta(remaining))
-            pbar.update(successful)
+        results = copy_keys_concurrently(source_bucket, destination_bucket, keys_to_process())
+        for done, (key, status, attempt, error) in enumerate(results, 1):
+            batch_number = (done - 1) // batch_size + 1
+            checkpoint.done(key)
+            log_copy_result(key, status, attempt, error, f"[{batch_number}]")
+            if status == "failed":
+                batch_failed.append(key)
+                failed += 1
+            else:
+                batch_copied.append(key)
+                processed += 1
+                pbar.update(1)
+            if done % batch_size == 0:
+                save_batch_results(batch_copied, batch_failed)
+                checkpoint.save()
+                logging.info("Batch %s: %s archived, %s failed (%s archived, %s failed in total)", batch_number, len(batch_copied), len(batch_failed), processed, failed)
+                batch_copied = []
+                batch_failed = []
+                update_eta()
+        save_batch_results(batch_copied, batch_failed)
+    checkpoint.clear()
+
+    if total_to_process == 0:
+        tqdm.write(f"{CHECK_ICON} All files have already been processed.")
+        return
 
     tqdm.write(f"{CHECK_ICON} Processing complete. Successfully processed: {processed} of {total_to_process}")
     tqdm.write(f"{ERROR_ICON} {failed} of {total_to_process} objects failed")
@@ -314,18 +625,13 @@ def copy_objects_in_batches(source_bucket, destination_bucket, batch_size=BATCH_
 
     # Show absolute stats: all copied keys vs. all keys in bucket
     copied_keys_total = len(load_copied_keys())
-    tqdm.write(f"{CHECK_ICON} Total archived keys: {copied_keys_total} of {total_keys} in bucket.")
+    if start_after is not None:
+        # The part of the folder before the checkpoint was not listed again
+        tqdm.write(f"{CHECK_ICON} Total archived keys: {copied_keys_total}.")
+    else:
+        tqdm.write(f"{CHECK_ICON} Total archived keys: {copied_keys_total} of {total_keys} in bucket.")
 
 def retry_failed_keys(source_bucket, destination_bucket, max_retries=MAX_RETRIES):
-    s3 = client(
-        's3',
-        ibm_api_key_id=os.environ['IAM_API_KEY'],
-        config=Config(signature_version='oauth'),
-        endpoint_url=f"https://s3.{os.environ['REGION']}.cloud-object-storage.appdomain.cloud"
-    )
-
-    keyprotect_crn = os.environ.get("KEY_PROTECT_CRN")  #
-
     prefix = os.environ.get("OBJECT_PREFIX", "").strip()
     failed_keys = load_failed_keys()
     if prefix:
@@ -341,67 +647,30 @@ def retry_failed_keys(source_bucket, destination_bucket, max_retries=MAX_RETRIES
     tqdm.write(f"{RETRY_ICON} Retrying {total} failed objects...")
 
     with tqdm(total=total, desc=f"{RETRY_ICON} Retry", unit="obj") as pbar:
+        to_retry = []
         for key in failed_keys:
             if key in copied_keys:
+                remove_key_from_failed_keys(key)
                 pbar.update(1)
-                continue
-
-            copy_source = {
-                'Bucket': source_bucket,
-                'Key': key
-            }
-
-            success = False
-            for attempt in range(1, max_retries + 1):
-                try:
-                    kwargs = dict(
-                        CopySource=copy_source,
-                        Bucket=destination_bucket,
-                        Key=key,
-                        MetadataDirective="REPLACE"
-                    )
-                    if keyprotect_crn:
-                        kwargs["ServerSideEncryption"] = "ibm-kms"
-                        kwargs["SSEKMSKeyId"] = keyprotect_crn
-                    s3.copy_object(**kwargs)
-                    tqdm.write(f"{CHECK_ICON} RETRY: {key} moved to archive successfully (attempt {attempt})")
-                    logging.info(f"RETRY: {key} moved to archive successfully (attempt {attempt})")
-                    save_copied_key(key)
-                    remove_key_from_failed_keys(key)  
-                    success = True
-                    break
-                except Exception as e:
-                    error_message = str(e)
-                    if "InvalidObjectState" in error_message and "Operation is not valid for the source object's storage class" in error_message:
-                        tqdm.write(f"{CHECK_ICON} RETRY: {key} already archived or in archive tier.")
-                        logging.info(f"RETRY: {key} already archived or in archive tier (treated as success).")
-                        save_copied_key(key)
-                        remove_key_from_failed_keys(key)
-                        success = True
-                        break
-                    else:
-                        tqdm.write(f"{ERROR_ICON} RETRY error moving {key} to archive (attempt {attempt}): {e}")
-                        logging.warning(f"RETRY: Error moving {key} to archive (attempt {attempt}): {e}")
-
-            if not success:
+            else:
+                to_retry.append(key)
+
+        # The retries run on the same copy workers as a normal run; only this
+        # thread writes the key files
+        results = copy_keys_concurrently(source_bucket, destination_bucket, ((key, "RETRY:") for key in to_retry), max_retries)
+        for key, status, attempt, error in results:
+            log_copy_result(key, status, attempt, error, "RETRY:")
+            if status == "failed":
                 remaining_keys.append(key)
-
+            else:
+                save_copied_key(key)
+                remove_key_from_failed_keys(key)
             pbar.update(1)
+    flush_copied_keys()
 
-    # Write remaining failed keys to new file(s)
-    # We also rotate here if > MAX_KEYS_PER_FILE
-    idx = 1
-    written = 0
-    if remaining_keys:
-        for i in range(0, len(remaining_keys), MAX_KEYS_PER_FILE):
-            fname = f"{FAILED_KEYS_PREFIX}_{idx}.txt"
-            with open(fname, "w") as f:
-                for key in remaining_keys[i:i+MAX_KEYS_PER_FILE]:
-                    f.write(f"{key}\n")
-            idx += 1
-            written += len(remaining_keys[i:i+MAX_KEYS_PER_FILE])
-    else:
-        clear_failed_keys()
+    # Rewrite the failed keys files once, without the keys archived now.
+    # Keys outside OBJECT_PREFIX and keys that failed again stay where they are.
+    compact_failed_keys()
 
     tqdm.write(f"{RETRY_ICON} Retry complete. Still remaining: {len(remaining_keys)}")
     logging.info(f"Retry complete. Remaining errors: {len(remaining_keys)}")
@@ -409,64 +678,113 @@ def retry_failed_keys(source_bucket, destination_bucket, max_retries=MAX_RETRIES
 
 
 # Remove successfully copied keys from failed_keys files
+# Archived keys are only marked (tombstoned) here; the files are rewritten once
+# by compact_failed_keys at the end of a retry and at exit
+FAILED_TOMBSTONES = set()
+
 def remove_key_from_failed_keys(key):
-    """Remove a key from all failed_keys files if it was successfully archived."""
+    """Marks a key as no longer failed because it was successfully archived."""
+    FAILED_TOMBSTONES.add(key)
+
+def compact_failed_keys():
+    """Removes the tombstoned keys from the failed_keys files, streaming each file once into a temp file that replaces it."""
+    if not FAILED_TOMBSTONES:
+        return
+    # The files are replaced, so the writer must not keep appending to the old ones
+    close_failed_keys()
     for fname in glob.glob(f"{FAILED_KEYS_PREFIX}_*.txt"):
-        if not os.path.exists(fname):
-            continue
-        with open(fname, "r") as f:
-            lines = f.readlines()
-        new_lines = [line for line in lines if line.strip() != key]
-        if len(new_lines) != len(lines):
-            with open(fname, "w") as f:
-                f.writelines(new_lines)
+        tmp_fname = f"{fname}.tmp"
+        removed = False
+        with open(fname, "r") as src, open(tmp_fname, "w", buffering=KEY_FILE_BUFFER_SIZE) as dst:
+            for line in src:
+                if line.rstrip("\n") in FAILED_TOMBSTONES:
+                    removed = True
+                else:
+                    dst.write(line)
+        if removed:
+            os.replace(tmp_fname, fname)
+        else:
+            os.remove(tmp_fname)
+    FAILED_TOMBSTONES.clear()
+
+atexit.register(compact_failed_keys)
 
 STRUCTURE_FILE = "structure.txt"
+STRUCTURE_FLUSH_INTERVAL = 10      # Min seconds between writing structure.txt while processing folders
+# structure.txt in memory: prefix -> archived count (None while the folder is not processed yet)
+STRUCTURE = {}
+STRUCTURE_FLUSHED_AT = 0.0
 
-def list_all_prefixes(s3, bucket, delimiter="/"):
-    """Listet alle Ordner/Unterordner (Prefixes) im Bucket rekursiv auf."""
+def list_all_prefixes(bucket, delimiter="/"):
+    """Listet alle Ordner/Unterordner (Prefixes) im Bucket auf, jede Ebene parallel (Breitensuche)."""
     prefixes = set()
-    def recurse(current_prefix=""):
-        paginator = s3.get_paginator('list_objects_v2')
+
+    def list_level(current_prefix):
+        # Each listing thread pages one level on its own client
+        paginator = get_thread_s3_client().get_paginator('list_objects_v2')
+        children = []
         for page in paginator.paginate(Bucket=bucket, Prefix=current_prefix, Delimiter=delimiter):
-            for cp in page.get('CommonPrefixes', []):
-                prefix = cp['Prefix']
-                prefixes.add(prefix)
-                recurse(prefix)
-    recurse()
+            children.extend(cp['Prefix'] for cp in page.get('CommonPrefixes', []))
+        return children
+
+    # Only the calling thread touches the set and submits the child tasks
+    with ThreadPoolExecutor(max_workers=LISTING_WORKERS, thread_name_prefix="list") as executor:
+        pending = {executor.submit(list_level, "")}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for prefix in future.result():
+                    if prefix not in prefixes:
+                        prefixes.add(prefix)
+                        pending.add(executor.submit(list_level, prefix))
     return sorted(prefixes)
 
-def write_structure_file(prefixes):
-    """Schreibt die Prefixes in die structure.txt."""
-    with open(STRUCTURE_FILE, "w") as f:
-        for prefix in prefixes:
-            f.write(f"{prefix}\n")
-
-def update_structure_file(prefix, archived_count):
-    """Fügt hinter dem Prefix die Anzahl archivierter Dateien ein."""
-    lines = []
+def load_structure_file():
+    """Liest structure.txt einmal in STRUCTURE ein (Prefix -> Anzahl archivierter Dateien, None = noch nicht bearbeitet)."""
+    STRUCTURE.clear()
     with open(STRUCTURE_FILE, "r") as f:
         for line in f:
-            if line.strip().startswith(prefix) and "|" not in line:
-                lines.append(f"{prefix} | {archived_count}\n")
-            else:
-                lines.append(line)
-    with open(STRUCTURE_FILE, "w") as f:
-        f.writelines(lines)
+            prefix, sep, archived_count = line.rstrip("\n").partition(" | ")
+            if prefix.strip():
+                STRUCTURE[prefix.strip()] = archived_count if sep else None
+
+def write_structure_file(prefixes=None):
+    """Schreibt STRUCTURE (oder neu gefundene Prefixes) in einem Durchgang in die structure.txt."""
+    global STRUCTURE_FLUSHED_AT
+    if prefixes is not None:
+        STRUCTURE.clear()
+        STRUCTURE.update((prefix, None) for prefix in prefixes)
+    tmp_file = f"{STRUCTURE_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        f.writelines(
+            f"{prefix}\n" if archived_count is None else f"{prefix} | {archived_count}\n"
+            for prefix, archived_count in STRUCTURE.items()
+        )
+    os.replace(tmp_file, STRUCTURE_FILE)
+    STRUCTURE_FLUSHED_AT = time.monotonic()
+
+def update_structure_file(prefix, archived_count):
+    """Trägt die Anzahl archivierter Dateien hinter dem Prefix ein. Die Datei wird höchstens alle STRUCTURE_FLUSH_INTERVAL Sekunden geschrieben."""
+    STRUCTURE[prefix] = archived_count
+    if time.monotonic() - STRUCTURE_FLUSHED_AT >= STRUCTURE_FLUSH_INTERVAL:
+        write_structure_file()
+
+def flush_structure_file():
+    """Schreibt noch nicht gespeicherte Änderungen an STRUCTURE in die structure.txt."""
+    if STRUCTURE:
+        write_structure_file()
+
+atexit.register(flush_structure_file)
 
 def get_prefixes_to_process():
-    """Liest alle Prefixes aus structure.txt, die noch nicht bearbeitet wurden."""
-    prefixes = []
-    with open(STRUCTURE_FILE, "r") as f:
-        for line in f:
-            if "|" not in line:
-                prefixes.append(line.strip())
-    return prefixes
+    """Gibt alle Prefixes aus structure.txt zurück, die noch nicht bearbeitet wurden."""
+    load_structure_file()
+    return [prefix for prefix, archived_count in STRUCTURE.items() if archived_count is None]
 
 def count_archived_for_prefix(prefix):
-    """Zählt, wie viele Keys für einen Prefix archiviert wurden."""
-    copied_keys = load_copied_keys()
-    return sum(1 for k in copied_keys if k.startswith(prefix))
+    """Gibt zurück, wie viele Keys für einen Prefix archiviert wurden."""
+    load_copied_keys()
+    return ARCHIVED_BY_PREFIX.get(prefix, 0)
 
 # --- Main Execution ---
 if __name__ == '__main__':
@@ -477,13 +795,7 @@ if __name__ == '__main__':
 
     # 1. Struktur extrahieren, falls structure.txt nicht existiert
     if not os.path.exists(STRUCTURE_FILE):
-        s3 = client(
-            's3',
-            ibm_api_key_id=os.environ['IAM_API_KEY'],
-            config=Config(signature_version='oauth'),
-            endpoint_url=f"https://s3.{os.environ['REGION']}.cloud-object-storage.appdomain.cloud"
-        )
-        prefixes = list_all_prefixes(s3, source_bucket)
+        prefixes = list_all_prefixes(source_bucket)
         write_structure_file(prefixes)
         print(f"Ordnerstruktur in {STRUCTURE_FILE} gespeichert.")
 
@@ -499,5 +811,6 @@ if __name__ == '__main__':
         archived_count = count_archived_for_prefix(prefix)
         update_structure_file(prefix, archived_count)
         print(f"Ordner {prefix} abgeschlossen: {archived_count} Dateien archiviert.")
+    flush_structure_file()
 
     print("Alle Ordner wurden bearbeitet.")
@@ -1,19 +1,29 @@
 import os
 import logging
+import queue
+import random
+import re
 import sqlite3
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from ibm_boto3 import client
 from ibm_botocore.client import Config
+from ibm_botocore.exceptions import ClientError, ConnectionError, HTTPClientError
 
 # --- Configuration Section ---
 
 BATCH_SIZE = 1000                  # Number of objects per batch
 MAX_RETRIES = 3                    # Max retries for copy operations
 BACKOFF_FACTOR = 2                 # Exponential backoff factor
-THROTTLE_DELAY = 0.3               # Initial delay (in seconds) between API calls
+MAX_REQUESTS_PER_SECOND = 100      # Copy requests per second across all threads
+MIN_REQUESTS_PER_SECOND = 1        # Lower bound when slowing down after rate-limit errors
+RATE_LIMIT_BURST = 100             # Max requests sent in a single burst
+RATE_LIMIT_REFILL_INTERVAL = 0.05  # Seconds between refills of the rate limiter
 USE_EMOJIS = True                  # Emoji output in logs
+MAX_WORKERS = 16                   # Number of parallel copy threads
+FOLDER_WORKERS = 4                 # Number of folders listed and copied at the same time
 
 LOG_DIR = "logs"
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -23,6 +33,21 @@ ENV_FILE_PATH = os.path.join(os.path.dirname(__file__), ".env")
 SQLITE_DB = "cos_status.db"
 FOLDER_PROGRESS_FILE = "folder_progress.log"
 
+# Storage classes the listing reports for objects already in the archive tier
+ARCHIVE_STORAGE_CLASSES = {"GLACIER", "ACCELERATED"}
+
+# Error codes and HTTP statuses of rate-limit responses
+RATE_LIMIT_ERROR_CODES = {"SlowDown", "Throttling", "ThrottlingException", "TooManyRequests"}
+RATE_LIMIT_STATUS_CODES = {429, 503}
+# Fallback for exceptions that carry no error code
+RATE_LIMIT_MESSAGE_RE = re.compile(r"TooManyRequests|Throttling|429|503")
+
+# Error codes worth retrying; other 4xx errors fail immediately
+TRANSIENT_ERROR_CODES = {
+    "SlowDown", "Throttling", "ThrottlingException", "TooManyRequests",
+    "RequestTimeout", "InternalError", "ServiceUnavailable",
+}
+
 # --- Logging Setup ---
 # Only WARNING and ERROR messages will be logged.
 logging.basicConfig(
@@ -53,11 +78,21 @@ def ensure_env():
 
 # --- Global SQLite connection ---
 DB_CONN = None
+# Folders are processed in parallel but share the connection, so every use is serialized
+DB_LOCK = threading.Lock()
 
 def get_db_conn():
     global DB_CONN
     if DB_CONN is None:
-        DB_CONN = sqlite3.connect(SQLITE_DB, check_same_thread=False)
+        # Autocommit mode, transactions are opened explicitly with BEGIN
+        DB_CONN = sqlite3.connect(SQLITE_DB, check_same_thread=False, isolation_level=None)
+        DB_CONN.execute("PRAGMA journal_mode=WAL")
+        DB_CONN.execute("PRAGMA synchronous=NORMAL")
+        DB_CONN.execute("PRAGMA temp_store=MEMORY")
+        DB_CONN.execute("PRAGMA cache_size=-65536")
+        DB_CONN.execute("PRAGMA mmap_size=268435456")
+        # Keys are case-sensitive, and only a case-sensitive LIKE can use the primary key index
+        DB_CONN.execute("PRAGMA case_sensitive_like=ON")
     return DB_CONN
 
 def close_db_conn():
@@ -68,6 +103,10 @@ def close_db_conn():
 
 # --- SQLite Database Functions (adapted) ---
 
+def like_prefix(prefix):
+    """Returns a LIKE pattern (used with ESCAPE '\\') matching all keys starting with prefix."""
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
 def init_db():
     """Initializes the SQLite database and creates tables if they do not exist."""
     conn = get_db_conn()
@@ -85,108 +124,171 @@ def init_db():
     conn.commit()
     return conn
 
-def save_copied_key_db(key):
-    """Saves a copied key to the database."""
+def save_copied_keys_db(keys, new_keys=False):
+    """
+    Saves copied keys to the database. Committed by the caller.
+    With new_keys the caller guarantees none of them is stored yet, so the conflict check is skipped.
+    """
     conn = get_db_conn()
-    try:
-        conn.execute("INSERT OR IGNORE INTO copied_keys (key) VALUES (?)", (key,))
-        conn.commit()
-    except Exception:
-        pass
+    if new_keys:
+        conn.executemany("INSERT INTO copied_keys (key) VALUES (?)", [(key,) for key in keys])
+    else:
+        conn.executemany("INSERT OR IGNORE INTO copied_keys (key) VALUES (?)", [(key,) for key in keys])
 
-def save_failed_key_db(key):
-    """Saves a failed key to the database."""
+def save_failed_keys_db(keys):
+    """Saves failed keys to the database. Committed by the caller."""
     conn = get_db_conn()
-    try:
-        conn.execute("INSERT OR IGNORE INTO failed_keys (key) VALUES (?)", (key,))
-        conn.commit()
-    except Exception:
-        pass
+    conn.executemany("INSERT OR IGNORE INTO failed_keys (key) VALUES (?)", [(key,) for key in keys])
 
-def remove_key_from_failed_keys_db(key):
-    """Removes a key from the failed_keys table."""
+def remove_keys_from_failed_keys_db(keys):
+    """Removes keys from the failed_keys table. Committed by the caller."""
     conn = get_db_conn()
-    conn.execute("DELETE FROM failed_keys WHERE key = ?", (key,))
-    conn.commit()
+    conn.executemany("DELETE FROM failed_keys WHERE key = ?", [(key,) for key in keys])
 
-def is_key_copied_db(key):
-    """Checks if a key is already marked as copied in the database."""
+def _write_batch_results_db(conn, copied, failed, new_keys):
+    """Writes the results of one batch in a single transaction, rolled back on error."""
+    conn.execute("BEGIN")
+    try:
+        save_copied_keys_db(copied, new_keys=new_keys)
+        remove_keys_from_failed_keys_db(copied)
+        save_failed_keys_db(failed)
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def save_batch_results_db(copied, failed, new_keys=False):
+    """Records the results of one batch in a single transaction (new_keys: see save_copied_keys_db)."""
     conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT 1 FROM copied_keys WHERE key = ?", (key,))
-    return c.fetchone() is not None
-
-def count_archived_for_prefix_db(prefix):
-    """Counts how many keys have been archived for a given prefix."""
+    try:
+        with DB_LOCK:
+            try:
+                _write_batch_results_db(conn, copied, failed, new_keys)
+            except sqlite3.IntegrityError:
+                if not new_keys:
+                    raise
+                # A key was stored already after all, write the batch again with the conflict check
+                _write_batch_results_db(conn, copied, failed, False)
+    except sqlite3.Error as e:
+        logging.warning(f"{ERROR_ICON} Could not save batch results to {SQLITE_DB}: {e}")
+
+def load_copied_keys_db(prefix):
+    """Returns the set of copied keys directly in the given prefix (not in subfolders)."""
     conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM copied_keys WHERE key LIKE ?", (f"{prefix}%",))
-    return c.fetchone()[0]
+    with DB_LOCK:
+        c = conn.execute("SELECT key FROM copied_keys WHERE key LIKE ? ESCAPE '\\'", (like_prefix(prefix),))
+        start = len(prefix)
+        return {key for (key,) in c if key.find("/", start) == -1}
 
 def get_failed_keys_db(prefix=None):
-    """Returns a list of failed keys, optionally filtered by prefix."""
+    """Returns a list of failed keys that are not copied yet, optionally filtered by prefix."""
     conn = get_db_conn()
     c = conn.cursor()
+    query = "SELECT key FROM failed_keys WHERE NOT EXISTS (SELECT 1 FROM copied_keys WHERE copied_keys.key = failed_keys.key)"
     if prefix:
-        c.execute("SELECT key FROM failed_keys WHERE key LIKE ?", (f"{prefix}%",))
+        c.execute(query + " AND key LIKE ? ESCAPE '\\'", (like_prefix(prefix),))
     else:
-        c.execute("SELECT key FROM failed_keys")
+        c.execute(query)
     return [row[0] for row in c.fetchall()]
 
-def clear_failed_keys_db():
-    """Clears all failed keys from the database."""
-    conn = get_db_conn()
-    conn.execute("DELETE FROM failed_keys")
-    conn.commit()
-
 # --- Throttling and Rate Limit Handling ---
 
-DYNAMIC_THROTTLE_DELAY = THROTTLE_DELAY
-DYNAMIC_THROTTLE_LOCK = threading.Lock()
+class TokenBucket:
+    """
+    Token bucket shared by all copy workers. A background thread refills the tokens,
+    so workers only block on a semaphore and take no lock of their own.
+    The rate is lowered on rate-limit errors and slowly raised again after successful requests.
+    """
 
-def dynamic_throttle(api_call):
-    """Dynamically adjustable throttling for API calls."""
-    global DYNAMIC_THROTTLE_DELAY
-    with DYNAMIC_THROTTLE_LOCK:
-        delay = DYNAMIC_THROTTLE_DELAY
-    time.sleep(delay)
-    return api_call()
+    def __init__(self, rate, capacity):
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = threading.BoundedSemaphore(capacity)
+        self.lock = threading.Lock()  # Only guards rate updates
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def _refill(self):
+        """Adds rate tokens per second, up to the capacity (runs in the background)."""
+        pending = 0.0
+        timestamp = time.monotonic()
+        while True:
+            time.sleep(RATE_LIMIT_REFILL_INTERVAL)
+            now = time.monotonic()
+            pending += (now - timestamp) * self.rate
+            timestamp = now
+            while pending >= 1:
+                pending -= 1
+                try:
+                    self.tokens.release()
+                except ValueError:
+                    # Bucket is full, unused capacity is not saved up
+                    pending = 0.0
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it."""
+        self.tokens.acquire()
+
+    def slow_down(self):
+        """Halves the rate (rate-limit error). Returns the new rate."""
+        with self.lock:
+            self.rate = max(self.rate / 2, MIN_REQUESTS_PER_SECOND)
+            return self.rate
+
+    def speed_up(self):
+        """Raises the rate again by ~10% (successful request), up to the configured maximum."""
+        if self.rate >= self.max_rate:
+            return
+        with self.lock:
+            self.rate = min(self.rate / 0.9, self.max_rate)
+
+RATE_LIMITER = TokenBucket(rate=MAX_REQUESTS_PER_SECOND, capacity=RATE_LIMIT_BURST)
+
+def backoff(attempt, backoff_factor=BACKOFF_FACTOR):
+    """Sleeps before the next attempt after a failed one (exponential, with a little jitter so the workers don't retry in lockstep)."""
+    time.sleep(backoff_factor ** attempt + random.random() * 0.1)
+
+def is_invalid_object_state(error):
+    """True if COS refused the copy because of the source object's storage class, i.e. the object is already archived."""
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") == "InvalidObjectState"
+
+def is_transient_error(e):
+    """Returns True for throttling, server-side and network errors. Everything else is not retried."""
+    if isinstance(e, ClientError):
+        code = e.response.get("Error", {}).get("Code")
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return code in TRANSIENT_ERROR_CODES or status == 429 or status >= 500
+    return isinstance(e, (ConnectionError, HTTPClientError))
 
 def handle_rate_limit_error(e):
-    """Detects rate-limit errors and increases the delay."""
-    global DYNAMIC_THROTTLE_DELAY
-    msg = str(e)
-    if any(x in msg for x in ["TooManyRequests", "Throttling", "429", "503"]):
-        with DYNAMIC_THROTTLE_LOCK:
-            DYNAMIC_THROTTLE_DELAY = min(DYNAMIC_THROTTLE_DELAY * 2, 60)  # Max 60s
-        logging.warning(f"Rate limit detected, increasing delay to {DYNAMIC_THROTTLE_DELAY:.1f}s")
+    """Detects rate-limit errors and lowers the request rate."""
+    if isinstance(e, ClientError):
+        code = e.response.get("Error", {}).get("Code")
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        rate_limited = code in RATE_LIMIT_ERROR_CODES or status in RATE_LIMIT_STATUS_CODES
+    else:
+        rate_limited = RATE_LIMIT_MESSAGE_RE.search(str(e)) is not None
+    if rate_limited:
+        rate = RATE_LIMITER.slow_down()
+        logging.warning(f"Rate limit detected, lowering request rate to {rate:.1f}/s")
         return True
     return False
 
 def reset_throttle_delay():
-    """Slowly reduces the delay after successful requests."""
-    global DYNAMIC_THROTTLE_DELAY
-    with DYNAMIC_THROTTLE_LOCK:
-        if DYNAMIC_THROTTLE_DELAY > THROTTLE_DELAY:
-            DYNAMIC_THROTTLE_DELAY = max(DYNAMIC_THROTTLE_DELAY * 0.9, THROTTLE_DELAY)
-
-def retry_with_backoff(func, max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR):
-    """Executes a function with exponential backoff."""
-    for attempt in range(1, max_retries + 1):
-        try:
-            return func()
-        except Exception as e:
-            if attempt == max_retries:
-                raise
-            time.sleep(backoff_factor ** attempt)
-
-def throttle(api_call, delay=THROTTLE_DELAY):
-    """Simple throttling for API calls."""
-    time.sleep(delay)
-    return api_call()
+    """Slowly raises the request rate again after successful requests."""
+    RATE_LIMITER.speed_up()
 
 # --- IBM COS Utility Functions ---
 
+def create_s3_client():
+    """Creates the S3 client shared by the listing and all copy threads."""
+    return client(
+        's3',
+        ibm_api_key_id=os.environ['IAM_API_KEY'],
+        # Retries are handled by _copy_one, not by botocore
+        config=Config(signature_version='oauth', max_pool_connections=MAX_WORKERS + FOLDER_WORKERS, retries={'max_attempts': 0}),
+        endpoint_url=f"https://s3.{os.environ['REGION']}.cloud-object-storage.appdomain.cloud"
+    )
+
 def get_top_level_prefixes(s3, bucket, delimiter="/"):
     """Returns all top-level folders (prefixes) in the bucket."""
     prefixes = []
@@ -198,121 +300,141 @@ def get_top_level_prefixes(s3, bucket, delimiter="/"):
 
 # --- Main Batch Processing Functions ---
 
-def process_batch(s3, source_bucket, destination_bucket, batch, batch_number, conn, max_retries=MAX_RETRIES):
+COPY_EXECUTOR = None
+
+def get_copy_executor():
+    """Returns the thread pool of copy workers, created on first use and shared by all batches."""
+    global COPY_EXECUTOR
+    if COPY_EXECUTOR is None:
+        COPY_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return COPY_EXECUTOR
+
+def copy_object_kwargs(source_bucket, destination_bucket):
+    """Returns the CopyObject arguments shared by all keys (everything except CopySource and Key)."""
+    kwargs = {"Bucket": destination_bucket}
+    # An in-place copy is only accepted if it changes the metadata; otherwise keep the existing metadata
+    if source_bucket == destination_bucket or os.environ.get("REPLACE_METADATA"):
+        kwargs["MetadataDirective"] = "REPLACE"
+    else:
+        kwargs["MetadataDirective"] = "COPY"
+    keyprotect_crn = os.environ.get("KEY_PROTECT_CRN")
+    if keyprotect_crn:
+        kwargs["ServerSideEncryption"] = "ibm-kms"
+        kwargs["SSEKMSKeyId"] = keyprotect_crn
+    return kwargs
+
+def _copy_one(s3, source_bucket, key, copy_kwargs, label, max_retries=MAX_RETRIES):
     """
-    Processes a batch of keys: copies them and updates the database.
-    Handles rate limits and retries.
+    Copies a single object in place (runs in a worker thread).
+    copy_kwargs comes from copy_object_kwargs.
+    Returns (key, success). The database is updated by the caller.
     """
-    successful_copies = 0
-    keyprotect_crn = os.environ.get("KEY_PROTECT_CRN")
-    for key in batch:
-        if is_key_copied_db(key):
-            continue
-
-        copy_source = {
-            'Bucket': source_bucket,
-            'Key': key
-        }
-
-        def copy_object():
-            kwargs = dict(
-                CopySource=copy_source,
-                Bucket=destination_bucket,
-                Key=key,
-                MetadataDirective="REPLACE"
-            )
-            if keyprotect_crn:
-                kwargs["ServerSideEncryption"] = "ibm-kms"
-                kwargs["SSEKMSKeyId"] = keyprotect_crn
-            s3.copy_object(**kwargs)
-
-        success = False
-        for attempt in range(1, max_retries + 1):
-            try:
-                retry_with_backoff(lambda: dynamic_throttle(copy_object))
-                reset_throttle_delay()
-                save_copied_key_db(key)
-                remove_key_from_failed_keys_db(key)
-                successful_copies += 1
-                success = True
+    for attempt in range(1, max_retries + 1):
+        try:
+            RATE_LIMITER.acquire()
+            s3.copy_object(CopySource={'Bucket': source_bucket, 'Key': key}, Key=key, **copy_kwargs)
+            reset_throttle_delay()
+            return key, True
+        except Exception as e:
+            if is_invalid_object_state(e):
+                return key, True
+            if not handle_rate_limit_error(e):
+                logging.warning(f"{ERROR_ICON} {label} Error moving {key} to archive (attempt {attempt}): {e}")
+            if not is_transient_error(e):
                 break
-            except Exception as e:
-                if handle_rate_limit_error(e):
-                    continue
-                error_message = str(e)
-                if "InvalidObjectState" in error_message and "Operation is not valid for the source object's storage class" in error_message:
-                    save_copied_key_db(key)
-                    remove_key_from_failed_keys_db(key)
-                    successful_copies += 1
-                    success = True
-                    break
-                else:
-                    logging.warning(f"{ERROR_ICON} [{batch_number}] Error moving {key} to archive (attempt {attempt}): {e}")
-
-        if not success:
-            save_failed_key_db(key)
-
-    return successful_copies
-
-def copy_objects_in_batches(source_bucket, destination_bucket, prefix, batch_size=BATCH_SIZE):
+            if attempt < max_retries:
+                backoff(attempt)
+    return key, False
+
+def copy_keys_concurrently(s3, source_bucket, destination_bucket, keys, label, max_retries=MAX_RETRIES, archived=(), new_keys=False):
+    """
+    Copies the given keys in parallel and records each result in the database.
+    Keys in archived are already in the archive tier and are recorded as copied without a request.
+    new_keys tells the database that none of the keys is recorded as copied yet.
+    Returns the list of successfully copied keys.
+    """
+    copied = list(archived)
+    failed = []
+    copy_kwargs = copy_object_kwargs(source_bucket, destination_bucket)
+    executor = get_copy_executor()
+    futures = [
+        executor.submit(_copy_one, s3, source_bucket, key, copy_kwargs, label, max_retries)
+        for key in keys
+    ]
+    for future in as_completed(futures):
+        key, success = future.result()
+        if success:
+            copied.append(key)
+        else:
+            failed.append(key)
+    # SQLite is only written from the calling folder thread, once per batch
+    save_batch_results_db(copied, failed, new_keys=new_keys)
+    return copied
+
+def process_batch(s3, source_bucket, destination_bucket, batch, batch_number, copied_keys, max_retries=MAX_RETRIES):
+    """
+    Processes a batch of listed objects that are not in copied_keys: copies them in parallel and updates the database.
+    Objects the listing reports as archived are only recorded. Handles rate limits and retries.
+    """
+    keys = []
+    archived = []
+    for obj in batch:
+        if obj.get('StorageClass') in ARCHIVE_STORAGE_CLASSES:
+            archived.append(obj['Key'])
+        else:
+            keys.append(obj['Key'])
+    copied = copy_keys_concurrently(s3, source_bucket, destination_bucket, keys, f"[{batch_number}]", max_retries, archived=archived, new_keys=True)
+    copied_keys.update(copied)
+    return len(copied)
+
+def copy_objects_in_batches(s3, source_bucket, destination_bucket, prefix, batch_size=BATCH_SIZE, delimiter="/"):
     """
     Copies only objects directly in the given prefix (not in subfolders).
+    The subfolders come from the same listing and are returned for the caller to process.
+    Returns (processed, total_keys, sub_prefixes).
     """
-    s3 = client(
-        's3',
-        ibm_api_key_id=os.environ['IAM_API_KEY'],
-        config=Config(signature_version='oauth'),
-        endpoint_url=f"https://s3.{os.environ['REGION']}.cloud-object-storage.appdomain.cloud"
-    )
-    conn = get_db_conn()
+    copied_keys = load_copied_keys_db(prefix)
     total_keys = 0
     processed = 0
     failed = 0
     batch = []
     batch_number = 1
+    sub_prefixes = []
 
-    paginate_kwargs = {"Bucket": source_bucket, "Delimiter": "/", "MaxKeys": 1000}
+    paginate_kwargs = {"Bucket": source_bucket, "Delimiter": delimiter, "MaxKeys": 1000}
     if prefix:
         paginate_kwargs["Prefix"] = prefix
 
     for page in s3.get_paginator('list_objects_v2').paginate(**paginate_kwargs):
-        # Only files directly in the current prefix (no subfolders)
+        for cp in page.get('CommonPrefixes', []):
+            sub_prefixes.append(cp['Prefix'])
+        # With the delimiter set, Contents only holds the files directly in the current prefix;
+        # files in subfolders are rolled up into CommonPrefixes
         for obj in page.get('Contents', []):
             key = obj['Key']
-            # Check if the object is directly in the prefix (no further slash after prefix)
-            if prefix and "/" in key[len(prefix):]:
-                continue  # Skip files in subfolders
             total_keys += 1
-            if is_key_copied_db(key):
+            if key in copied_keys:
                 continue
-            batch.append(key)
+            batch.append(obj)
             if len(batch) >= batch_size:
-                successful = process_batch(s3, source_bucket, destination_bucket, batch, batch_number, conn)
+                successful = process_batch(s3, source_bucket, destination_bucket, batch, batch_number, copied_keys)
                 processed += successful
                 failed += (len(batch) - successful)
                 batch = []
                 batch_number += 1
     # Process the last batch
     if batch:
-        successful = process_batch(s3, source_bucket, destination_bucket, batch, batch_number, conn)
+        successful = process_batch(s3, source_bucket, destination_bucket, batch, batch_number, copied_keys)
         processed += successful
         failed += (len(batch) - successful)
 
-    return processed, total_keys
+    return processed, total_keys, sub_prefixes
 
-def retry_failed_keys(source_bucket, destination_bucket, max_retries=MAX_RETRIES):
+def retry_failed_keys(s3, source_bucket, destination_bucket, max_retries=MAX_RETRIES):
     """
     Retries copying of failed keys.
     Uses SQLite for status tracking and logging for progress.
     """
-    s3 = client(
-        's3',
-        ibm_api_key_id=os.environ['IAM_API_KEY'],
-        config=Config(signature_version='oauth'),
-        endpoint_url=f"https://s3.{os.environ['REGION']}.cloud-object-storage.appdomain.cloud"
-    )
-    conn = get_db_conn()
-    keyprotect_crn = os.environ.get("KEY_PROTECT_CRN")
     prefix = os.environ.get("OBJECT_PREFIX", "").strip()
     failed_keys = get_failed_keys_db(prefix=prefix if prefix else None)
     if not failed_keys:
@@ -322,111 +444,97 @@ def retry_failed_keys(source_bucket, destination_bucket, max_retries=MAX_RETRIES
     total = len(failed_keys)
     logging.warning(f"{RETRY_ICON} Retrying {total} failed objects...")
 
-    for key in failed_keys:
-        if is_key_copied_db(key):
-            continue
+    # Keys that succeed are removed from failed_keys, keys that fail again stay
+    copy_keys_concurrently(s3, source_bucket, destination_bucket, failed_keys, "RETRY", max_retries)
 
-        copy_source = {
-            'Bucket': source_bucket,
-            'Key': key
-        }
-
-        success = False
-        for attempt in range(1, max_retries + 1):
-            try:
-                kwargs = dict(
-                    CopySource=copy_source,
-                    Bucket=destination_bucket,
-                    Key=key,
-                    MetadataDirective="REPLACE"
-                )
-                if keyprotect_crn:
-                    kwargs["ServerSideEncryption"] = "ibm-kms"
-                    kwargs["SSEKMSKeyId"] = keyprotect_crn
-                s3.copy_object(**kwargs)
-                save_copied_key_db(key)
-                remove_key_from_failed_keys_db(key)
-                success = True
-                break
-            except Exception as e:
-                if handle_rate_limit_error(e):
-                    continue
-                error_message = str(e)
-                if "InvalidObjectState" in error_message and "Operation is not valid for the source object's storage class" in error_message:
-                    save_copied_key_db(key)
-                    remove_key_from_failed_keys_db(key)
-                    success = True
-                    break
-                else:
-                    logging.warning(f"{ERROR_ICON} RETRY error moving {key} to archive (attempt {attempt}): {e}")
-
-        if not success:
-            save_failed_key_db(key)
-
-    clear_failed_keys_db()
     logging.warning(f"{RETRY_ICON} Retry complete.")
 
 # --- Folder Progress Logging ---
 
-def log_folder_progress(prefix, processed, total):
-    """Appends folder processing info to a progress log file."""
-    with open(FOLDER_PROGRESS_FILE, "a") as f:
-        f.write(f"{prefix}\t{processed}/{total} files processed\n")
-
-# --- Prefix Processing (Iterative) ---
+FOLDER_PROGRESS_FP = None
+FOLDER_PROGRESS_LOCK = threading.Lock()
 
-def process_prefix_tree_iterative(s3, source_bucket, destination_bucket, root_prefix="", delimiter="/"):
+def log_folder_progress(prefix, processed, total):
+    """Appends folder processing info to a progress log file (opened once, line-buffered)."""
+    global FOLDER_PROGRESS_FP
+    with FOLDER_PROGRESS_LOCK:
+        if FOLDER_PROGRESS_FP is None:
+            FOLDER_PROGRESS_FP = open(FOLDER_PROGRESS_FILE, "a", buffering=1)
+        FOLDER_PROGRESS_FP.write(f"{prefix}\t{processed}/{total} files processed\n")
+
+def close_folder_progress():
+    global FOLDER_PROGRESS_FP
+    if FOLDER_PROGRESS_FP:
+        FOLDER_PROGRESS_FP.close()
+        FOLDER_PROGRESS_FP = None
+
+# --- Prefix Processing (Concurrent) ---
+
+def process_prefix_tree_iterative(s3, source_bucket, destination_bucket, root_prefixes=("",), delimiter="/"):
     """
-    Iteratively processes all objects and subfolders under the given prefix (depth-first, no recursion).
-    Each prefix is processed as soon as it is discovered.
+    Processes all objects and subfolders under the given prefixes (no recursion).
+    FOLDER_WORKERS threads take folders from a shared queue, so several folders are listed
+    and copied at the same time; the subfolders found while listing are added to the queue.
     Logs progress for each folder after processing.
     """
-    stack = [root_prefix]
-    while stack:
-        current_prefix = stack.pop()
-        logging.warning(f"Processing prefix: {current_prefix}")
-
-        # Process files in this prefix and count total files in one go
-        before = count_archived_for_prefix_db(current_prefix)
-        processed, total_files = copy_objects_in_batches(source_bucket, destination_bucket, current_prefix, batch_size=BATCH_SIZE)
-        after = count_archived_for_prefix_db(current_prefix)
-        processed = after - before
-
-        # Log folder progress
-        log_folder_progress(current_prefix, processed, total_files)
-        logging.warning(f"Folder {current_prefix} processed: {processed}/{total_files} files.")
-
-        # Find sub-prefixes (subfolders) and add them to the stack
-        paginator = s3.get_paginator('list_objects_v2')
-        for page in paginator.paginate(Bucket=source_bucket, Prefix=current_prefix, Delimiter=delimiter):
-            for cp in page.get('CommonPrefixes', []):
-                sub_prefix = cp['Prefix']
-                stack.append(sub_prefix)
+    folders = queue.Queue()
+    errors = []
+
+    def worker():
+        while True:
+            current_prefix = folders.get()
+            if current_prefix is None:
+                return
+            try:
+                logging.warning(f"Processing prefix: {current_prefix}")
+
+                # Process files in this prefix and count total files in one go
+                processed, total_files, sub_prefixes = copy_objects_in_batches(s3, source_bucket, destination_bucket, current_prefix, batch_size=BATCH_SIZE, delimiter=delimiter)
+
+                # Log folder progress
+                log_folder_progress(current_prefix, processed, total_files)
+                logging.warning(f"Folder {current_prefix} processed: {processed}/{total_files} files.")
+
+                # Add the sub-prefixes (subfolders) found while listing to the queue
+                for sub_prefix in sub_prefixes:
+                    folders.put(sub_prefix)
+            except Exception as e:
+                logging.error(f"{ERROR_ICON} Error processing prefix {current_prefix}: {e}")
+                errors.append(e)
+            finally:
+                folders.task_done()
+
+    for root_prefix in root_prefixes:
+        folders.put(root_prefix)
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(FOLDER_WORKERS)]
+    for thread in threads:
+        thread.start()
+    folders.join()
+    for _ in threads:
+        folders.put(None)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
 
 # --- Main Execution ---
 
 if __name__ == '__main__':
     ensure_env()
     init_db()
+    source_bucket = os.environ['SOURCE_BUCKET']
+    destination_bucket = os.environ['DESTINATION_BUCKET']
+    s3 = create_s3_client()
     try:
-        source_bucket = os.environ['SOURCE_BUCKET']
-        destination_bucket = os.environ['DESTINATION_BUCKET']
-        s3 = client(
-            's3',
-            ibm_api_key_id=os.environ['IAM_API_KEY'],
-            config=Config(signature_version='oauth'),
-            endpoint_url=f"https://s3.{os.environ['REGION']}.cloud-object-storage.appdomain.cloud"
-        )
-
         # Get all top-level folders (prefixes)
         top_level_prefixes = get_top_level_prefixes(s3, source_bucket, delimiter="/")
 
         # Optional: If you want to process files directly in the root, uncomment the next line:
-        # process_prefix_tree_iterative(s3, source_bucket, destination_bucket, root_prefix="")
+        # process_prefix_tree_iterative(s3, source_bucket, destination_bucket, root_prefixes=[""])
 
-        # Process each top-level folder
-        for prefix in top_level_prefixes:
-            process_prefix_tree_iterative(s3, source_bucket, destination_bucket, root_prefix=prefix)
+        # Process all top-level folders from one queue, so the folder workers
+        # are shared across the whole bucket
+        process_prefix_tree_iterative(s3, source_bucket, destination_bucket, root_prefixes=top_level_prefixes)
 
         logging.warning("All folders have been processed.")
         conn = get_db_conn()
@@ -437,5 +545,6 @@ if __name__ == '__main__':
         print(f"Total archived files: {total_archived}")
     finally:
         # At the end, try all failed keys again
-        retry_failed_keys(source_bucket, destination_bucket)
+        retry_failed_keys(s3, source_bucket, destination_bucket)
+        close_folder_progress()
         close_db_conn()
\ No newline at end of file
@@ -1,31 +1,16 @@
 import os
 import sys
-import random
 import logging
+import logging.handlers
 from dotenv import load_dotenv
-from ibm_boto3 import client
-from ibm_botocore.client import Config
 import sqlite3
 import json
 import time
 from datetime import datetime, timedelta
 import concurrent.futures
+import functools
 import queue
-import psutil
-
-################### EXCEPTION HANDLING SETUP ###################
-# Setup exception handling for different client libraries
-try:
-    from ibm_botocore.exceptions import ClientError
-except ImportError:
-    try:
-        from botocore.exceptions import ClientError
-    except ImportError:
-        # Generic fallback if neither library is available
-        class ClientError(Exception):
-            def __init__(self, error, operation_name):
-                self.response = {'Error': {'Code': error}}
-                self.operation_name = operation_name
+import atexit
 
 ################### LOGGING CONFIGURATION ###################
 # Configure logging with appropriate handlers based on execution mode
@@ -37,13 +22,28 @@ else:
     # Use timestamped log file for other operations
     log_file = f"archive_process_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
 
+# The file and console handlers run on a listener thread; logging calls only
+# put the record on a queue, so no thread waits for the log file
+log_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+log_handlers = [
+    logging.FileHandler(log_file),
+    logging.StreamHandler()
+]
+for log_handler in log_handlers:
+    log_handler.setFormatter(log_formatter)
+
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+# Write out the remaining records on exit
+atexit.register(log_listener.stop)
+
+# The queued records keep their plain message; the listener's handlers format them
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter("%(message)s"))
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
+    handlers=[queue_handler]
 )
 logger = logging.getLogger(__name__)
 
@@ -51,14 +51,73 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 ################### DATABASE OPTIMIZATION ###################
+# Size of the prepared statement cache of the listing and archiving connections
+DB_CACHED_STATEMENTS = 256
+# Listed pages are staged in a temporary table and merged into cos_objects
+# (together with the continuation token) every this many pages, or after
+# this many seconds when listing is slow
+LISTING_MERGE_PAGES = 20
+LISTING_MERGE_INTERVAL = 30
+
+# Statements run for every listing page or archive batch, defined once so the
+# same string objects hit the connection's prepared statement cache
+# Keys that are already present are left as they are (no delete and reinsert
+# as with INSERT OR REPLACE); needs SQLite 3.24+
+SQL_STAGE_COS_OBJECT = "INSERT INTO staged_objects (key) VALUES (?)"
+SQL_STAGE_COS_OBJECT_WITH_DATE = "INSERT INTO staged_objects (key, last_modified) VALUES (?, ?)"
+# "WHERE true" keeps ON CONFLICT from being parsed as part of the SELECT
+SQL_MERGE_STAGED_OBJECTS = "INSERT INTO cos_objects (key) SELECT key FROM staged_objects WHERE true ORDER BY key ON CONFLICT(key) DO NOTHING"
+SQL_MERGE_STAGED_OBJECTS_WITH_DATE = "INSERT INTO cos_objects (key, last_modified) SELECT key, last_modified FROM staged_objects WHERE true ORDER BY key ON CONFLICT(key) DO NOTHING"
+SQL_CLEAR_STAGED_OBJECTS = "DELETE FROM staged_objects"
+SQL_UPDATE_LISTING_STATS = "UPDATE listing_stats SET total_objects = ?, last_update_time = datetime('now') WHERE id = 1"
+SQL_UPDATE_FILTERED_LISTING_STATS = "UPDATE listing_stats SET total_objects = ?, filtered_objects = ?, last_update_time = datetime('now') WHERE id = 1"
+SQL_SAVE_CONTINUATION_TOKEN = "INSERT OR REPLACE INTO continuation_state (id, continuation_token, last_updated) VALUES (1, ?, CURRENT_TIMESTAMP)"
+SQL_SELECT_BATCH = "SELECT rowid, key FROM cos_objects ORDER BY rowid LIMIT ?"
+SQL_INSERT_COPIED_KEY = "INSERT INTO copied_keys (key, timestamp) VALUES (?, datetime('now')) ON CONFLICT(key) DO NOTHING"
+SQL_INSERT_FAILED_KEY = (
+    "INSERT INTO failed_keys (key, error, timestamp, attempts) VALUES (?, ?, datetime('now'), 1) "
+    "ON CONFLICT(key) DO UPDATE SET attempts = COALESCE(attempts, 0) + 1, error = excluded.error, timestamp = excluded.timestamp"
+)
+SQL_DELETE_COS_OBJECT_RANGE = "DELETE FROM cos_objects WHERE rowid BETWEEN ? AND ?"
+SQL_UPDATE_ARCHIVE_STATS = "UPDATE archive_stats SET total_success = total_success + ?, total_failures = total_failures + ?, last_update_time = datetime('now') WHERE id = 1"
+
 # Optimize SQLite database performance
-def optimize_db_connection(conn):
-    """Apply performance optimizations to database connection."""
-    conn.execute("PRAGMA journal_mode = WAL")
-    conn.execute("PRAGMA synchronous = NORMAL")
-    conn.execute("PRAGMA temp_store = MEMORY")
-    conn.execute("PRAGMA cache_size = -20000")  # 20MB cache
-    conn.execute("PRAGMA mmap_size = 30000000000")  # 30GB memory map if available
+COMMON_PRAGMAS = """
+    PRAGMA journal_mode = WAL;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA mmap_size = 30000000000;     -- 30GB memory map if available
+    PRAGMA busy_timeout = 60000;        -- Same 60s lock wait as timeout=60, also for connections opened without it
+    PRAGMA wal_autocheckpoint = 10000;  -- Checkpoint the WAL every 10000 pages
+    PRAGMA journal_size_limit = 67108864;  -- Truncate the WAL to 64MB after a checkpoint
+"""
+DEFAULT_PRAGMAS = COMMON_PRAGMAS + """
+    PRAGMA synchronous = NORMAL;
+    PRAGMA cache_size = -65536;         -- 64MB cache
+"""
+BULK_LOAD_PRAGMAS = COMMON_PRAGMAS + """
+    PRAGMA synchronous = OFF;
+    PRAGMA cache_size = -131072;        -- 128MB cache
+"""
+
+def optimize_db_connection(conn, bulk_load=False):
+    """
+    Apply performance optimizations to database connection.
+    With bulk_load the commits are not synced to disk, so an OS crash or
+    power loss can corrupt the whole database file. Only used for listing
+    into a database that holds no archiving results yet (see
+    has_archive_records), where the listing can simply be rerun.
+    """
+    # All PRAGMAs are sent in one executescript call
+    conn.executescript(BULK_LOAD_PRAGMAS if bulk_load else DEFAULT_PRAGMAS)
+
+def has_archive_records(db_path):
+    """Return True if the database already records copied or failed objects from earlier archive runs."""
+    with sqlite3.connect(db_path, timeout=60) as conn:
+        for table in ("copied_keys", "failed_keys"):
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+            if exists and conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return True
+    return False
 
 def create_indexes(conn):
     """Create indexes on main tables to improve query performance."""
@@ -67,42 +126,36 @@ def create_indexes(conn):
     conn.execute("CREATE INDEX IF NOT EXISTS idx_failed_keys_key ON failed_keys(key)")
 
 ################### RETRY MECHANISM ###################
-# Implement retry logic with exponential backoff
-def retry_with_backoff(func, *args, **kwargs):
-    """Execute a function with exponential backoff retry logic."""
-    max_retries = 10
-    base_delay = 1
-    max_delay = 300  # 5 minutes max delay
-    
-    for attempt in range(max_retries):
-        try:
-            return func(*args, **kwargs)
-        except ClientError as e:
-            error_code = e.response['Error']['Code']
-            
-            # Rate limit errors
-            if error_code in ['TooManyRequests', 'SlowDown', 'RequestLimitExceeded', '429']:
-                delay = min(max_delay, (base_delay * 2 ** attempt) + random.uniform(0, 1))
-                logger.warning(f"Rate limited, attempt {attempt+1}/{max_retries}, waiting {delay:.2f} seconds...")
-                time.sleep(delay)
-            # Handle network/timeout errors
-            elif error_code in ['RequestTimeout', 'InternalError', 'ServiceUnavailable']:
-                delay = min(max_delay, (base_delay * 2 ** attempt) + random.uniform(0, 1))
-                logger.warning(f"Service unavailable, attempt {attempt+1}/{max_retries}, waiting {delay:.2f} seconds...")
-                time.sleep(delay)
-            else:
-                # Other errors should be raised immediately
-                logger.error(f"Unhandled error: {str(e)}")
-                raise
-        except Exception as e:
-            # Non-ClientError exceptions
-            logger.error(f"Unexpected error: {str(e)}")
-            raise
-            
-    # If we get here, we've exhausted our retries
-    raise Exception(f"Maximum retry attempts ({max_retries}) reached")
+# Retries are left to the client: adaptive mode backs off on throttling and
+# service errors and limits the client's request rate while COS is throttling
+COS_RETRIES = {'mode': 'adaptive', 'max_attempts': 10}
 
 ################### OBJECT LISTING ###################
+# Fetch listing pages ahead of the database writes
+def prefetch_list_pages(cos, bucket_name, continuation_token=None):
+    """
+    Yield list_objects_v2 responses, starting at continuation_token.
+    The pages come from a boto3 paginator. The next page is fetched from a
+    background thread while the caller stores the current one.
+    """
+    paginator = cos.get_paginator('list_objects_v2')
+    
+    pagination_config = {"PageSize": 1000}
+    if continuation_token:
+        pagination_config["StartingToken"] = continuation_token
+    
+    pages = iter(paginator.paginate(Bucket=bucket_name, PaginationConfig=pagination_config))
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        # Get the objects (the client retries failed requests)
+        future = executor.submit(next, pages, None)
+        while True:
+            response = future.result()
+            if response is None:
+                return
+            future = executor.submit(next, pages, None)
+            yield response
+
 # List all objects from COS bucket to SQLite database
 def list_cos_objects_to_sqlite(bucket_name, db_path, continuation_token=None):
     """List objects in COS bucket and store keys in SQLite database."""
@@ -111,6 +164,9 @@ def list_cos_objects_to_sqlite(bucket_name, db_path, continuation_token=None):
     
     logger.info(f"Starting listing objects from bucket: {bucket_name}")
     
+    from ibm_boto3 import client
+    from ibm_botocore.client import Config
+    
     # Build up the S3 Client using environment variables
     cos = client(
         's3',
@@ -118,7 +174,7 @@ def list_cos_objects_to_sqlite(bucket_name, db_path, continuation_token=None):
         config=Config(
             signature_version='oauth',
             max_pool_connections=100,  # Increase connection pool
-            retries={'max_attempts': 3},  # Let boto3 handle basic retries
+            retries=COS_RETRIES,
             connect_timeout=60,  # Increase timeouts for large operations
             read_timeout=60
         ),
@@ -126,8 +182,14 @@ def list_cos_objects_to_sqlite(bucket_name, db_path, continuation_token=None):
     )
 
     # SQLite DB connection
-    with sqlite3.connect(db_path, timeout=60) as conn:
-        optimize_db_connection(conn)
+    # Skip fsync only while the database holds nothing but listing data
+    bulk_load = not has_archive_records(db_path)
+    if not bulk_load:
+        logger.info("Database already holds archiving results, listing with synchronous commits")
+    
+    # Autocommit mode: the merge transactions are opened explicitly below
+    with sqlite3.connect(db_path, timeout=60, cached_statements=DB_CACHED_STATEMENTS, isolation_level=None) as conn:
+        optimize_db_connection(conn, bulk_load=bulk_load)
         c = conn.cursor()
         
         # Create needed tables
@@ -137,6 +199,9 @@ def list_cos_objects_to_sqlite(bucket_name, db_path, continuation_token=None):
             )
         """)
         
+        # Unindexed staging table, kept in memory and private to this connection
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS staged_objects (key TEXT)")
+        
         c.execute("""
             CREATE TABLE IF NOT EXISTS continuation_state (
                 id INTEGER PRIMARY KEY CHECK (id = 1),
@@ -179,104 +244,67 @@ def list_cos_objects_to_sqlite(bucket_name, db_path, continuation_token=None):
                     total_objects = result[0]
                     logger.info(f"Already processed {total_objects} objects in previous runs")
 
-        # Create transaction batches to avoid enormous transactions
-        tx_batch_size = 10000
-        objects_in_current_tx = 0
-        objects_processed_since_cursor_reset = 0
-        
         try:
             # Initialize response outside the loop
             more_objects = True
+            staged_pages = 0
+            staged_count = 0
+            last_merge_time = time.time()
             
-            while more_objects:
-                # Prepare parameters for listing objects
-                list_objects_params = {
-                    "Bucket": bucket_name,
-                    "MaxKeys": 1000
-                }
-                # Add continuation token if we have one
-                if continuation_token:
-                    list_objects_params["ContinuationToken"] = continuation_token
-                
-                # Get the objects with retry logic
-                def list_objects():
-                    return cos.list_objects_v2(**list_objects_params)
-                    
+            # The next page is already being fetched while this one is written
+            for response in prefetch_list_pages(cos, bucket_name, continuation_token):
                 try:
-                    response = retry_with_backoff(list_objects)
+                    # Append the page to the staging table; the staged pages
+                    # and their merge form one transaction
+                    contents = response.get("Contents", [])
+                    if staged_pages == 0:
+                        c.execute("BEGIN")
+                    c.executemany(SQL_STAGE_COS_OBJECT, [(obj["Key"],) for obj in contents])
+                    staged_pages += 1
+                    staged_count += len(contents)
+                    logger.info(f"Staged batch with {len(contents)} objects. Total processed: {total_objects + staged_count}")
                     
-                    # Process contents
-                    batch_count = 0
-                    for obj in response.get("Contents", []):
-                        c.execute(
-                            "INSERT OR REPLACE INTO cos_objects (key) VALUES (?)",
-                            (obj["Key"],)
-                        )
-                        batch_count += 1
-                        total_objects += 1
-                        objects_in_current_tx += 1
-                        objects_processed_since_cursor_reset += 1
-                        
-                        # Commit in smaller batches to avoid huge transactions
-                        if objects_in_current_tx >= tx_batch_size:
-                            conn.commit()
-                            # Update stats
-                            c.execute("""
-                                UPDATE listing_stats 
-                                SET total_objects = ?, last_update_time = datetime('now')
-                                WHERE id = 1
-                            """, (total_objects,))
-                            conn.commit()
-                            objects_in_current_tx = 0
+                    next_token = response.get("NextContinuationToken")
+                    if (next_token and staged_pages < LISTING_MERGE_PAGES
+                            and time.time() - last_merge_time < LISTING_MERGE_INTERVAL):
+                        continue
+                    
+                    # Merge the staged pages in key order; keys that are
+                    # already listed are skipped without rewriting their row
+                    c.execute(SQL_MERGE_STAGED_OBJECTS)
+                    c.execute(SQL_CLEAR_STAGED_OBJECTS)
+                    c.execute(SQL_UPDATE_LISTING_STATS, (total_objects + staged_count,))
                     
-                    logger.info(f"Processed batch with {batch_count} objects. Total processed: {total_objects}")
+                    # The token is only saved together with the keys it covers
+                    if next_token:
+                        c.execute(SQL_SAVE_CONTINUATION_TOKEN, (next_token,))
                     
-                    # Save progress after processing each batch
-                    if response.get("NextContinuationToken"):
-                        continuation_token = response["NextContinuationToken"]
-                        c.execute("""
-                            INSERT OR REPLACE INTO continuation_state (id, continuation_token, last_updated) 
-                            VALUES (1, ?, CURRENT_TIMESTAMP)
-                        """, (continuation_token,))
-                        conn.commit()
+                    c.execute("COMMIT")
+                    total_objects += staged_count
+                    logger.info(f"Merged {staged_pages} staged batches. Total saved: {total_objects}")
+                    staged_pages = 0
+                    staged_count = 0
+                    last_merge_time = time.time()
+                    if next_token:
                         logger.info(f"Continuation token saved.")
                     else:
                         more_objects = False
                         logger.info("Reached end of bucket listing.")
                 
                 except Exception as e:
-                    # If we fail during a batch, save what we have and re-raise
+                    # Batches staged since the last merge are not committed and
+                    # are listed again from the saved token
                     logger.error(f"Error during object listing: {str(e)}")
-                    if objects_in_current_tx > 0:
-                        conn.commit()
-                        logger.info(f"Saved progress before error, total processed: {total_objects}")
                     raise
                     
-                # Reset cursor periodically
-                if objects_processed_since_cursor_reset >= 100000:
-                    # Commit any pending changes first
-                    if objects_in_current_tx > 0:
-                        conn.commit()
-                        objects_in_current_tx = 0
-                    
-                    # Close and recreate cursor
-                    logger.debug("Recycling database cursor after 100,000 objects")
-                    c.close()
-                    c = conn.cursor()
-                    objects_processed_since_cursor_reset = 0
-                    
         except KeyboardInterrupt:
             logger.warning("Process interrupted. Progress has been saved.")
-            conn.commit()
+            conn.rollback()
         except Exception as e:
             logger.error(f"Error: {str(e)}")
-            conn.commit()
+            conn.rollback()
             raise
         finally:
-            # Make sure changes are committed
-            if objects_in_current_tx > 0:
-                conn.commit()
-                
             # Update final stats
             c.execute("""
                 UPDATE listing_stats 
@@ -354,56 +382,20 @@ def cleanup_after_listing(db_path):
         
         logger.info(f"Starting cleanup with {before_count} objects in cos_objects table")
         
-        # Remove entries from cos_objects that are already in copied_keys (in batches to avoid locking)
+        # Remove entries from cos_objects that are already in copied_keys
         c.execute("SELECT COUNT(*) FROM copied_keys")
         copied_total = c.fetchone()[0]
         
         if copied_total > 0:
             logger.info(f"Removing {copied_total} already processed objects from cos_objects")
             
-            # For very large tables, use keyset pagination
-            last_key = ""
-            batch_size = 100000
-            deleted = 0
+            # One statement in one transaction; both sides are looked up through
+            # their primary keys, without the sorted LIMIT scans of a batched delete
+            c.execute("DELETE FROM cos_objects WHERE key IN (SELECT key FROM copied_keys)")
+            deleted = c.rowcount
+            conn.commit()
             
-            while True:
-                # Use keyset pagination (WHERE key > last_processed_key ORDER BY key LIMIT batch_size)
-                c.execute("""
-                    DELETE FROM cos_objects 
-                    WHERE key IN (
-                        SELECT o.key FROM cos_objects o
-                        JOIN copied_keys c ON c.key = o.key
-                        WHERE o.key > ?
-                        ORDER BY o.key
-                        LIMIT ?
-                    )
-                """, (last_key, batch_size))
-                
-                deleted_batch = c.rowcount
-                deleted += deleted_batch
-                
-                if deleted_batch > 0:
-                    # Get the last processed key for the next batch
-                    c.execute("""
-                        SELECT MAX(key) FROM (
-                            SELECT o.key FROM cos_objects o
-                            JOIN copied_keys c ON c.key = o.key
-                            WHERE o.key > ?
-                            ORDER BY o.key
-                            LIMIT ?
-                        )
-                    """, (last_key, batch_size))
-                    
-                    result = c.fetchone()
-                    if result[0]:
-                        last_key = result[0]
-                
-                conn.commit()
-                
-                logger.info(f"Removed batch of {deleted_batch} objects, total removed: {deleted}")
-                
-                if deleted_batch < batch_size:
-                    break
+            logger.info(f"Removed {deleted} already processed objects from cos_objects")
         
         # Get counts for reporting
         c.execute("SELECT COUNT(*) FROM cos_objects")
@@ -421,6 +413,98 @@ def cleanup_after_listing(db_path):
     logger.info(f"  - {failed_count} objects previously failed")
 
 ################### MAIN ARCHIVING PROCESS ###################
+# Upper bound for the number of archive worker threads. A copy mostly waits for
+# COS, so many more copies than CPU cores can be in flight; ThrottleController
+# slows the workers down once COS starts rejecting requests.
+MAX_ARCHIVE_WORKERS = 256
+# HTTP connection pool of the archive client, one connection per worker
+ARCHIVE_POOL_CONNECTIONS = MAX_ARCHIVE_WORKERS
+# Checkpoint and truncate the WAL between batches every this many batches
+WAL_CHECKPOINT_BATCHES = 100
+
+_archive_client = None
+
+def get_archive_client():
+    """Return the S3 client for the in-place copies, created once and shared by all worker threads."""
+    global _archive_client
+    if _archive_client is None:
+        from ibm_boto3 import client
+        from ibm_botocore.client import Config
+        
+        # Build up the S3 Client using environment variables
+        _archive_client = client(
+            's3',
+            ibm_api_key_id=os.environ.get('IAM_API_KEY'),
+            config=Config(
+                signature_version='oauth',
+                max_pool_connections=ARCHIVE_POOL_CONNECTIONS,
+                retries=COS_RETRIES,
+                connect_timeout=60,
+                read_timeout=60
+            ),
+            endpoint_url=f"https://s3.{os.environ.get('REGION')}.cloud-object-storage.appdomain.cloud"
+        )
+    return _archive_client
+
+# Create the archiving tables once before the batch loop
+def ensure_archive_schema(db_path):
+    """Create the tables and indexes used by archive_objects and seed its stats row."""
+    with sqlite3.connect(db_path, timeout=60) as conn:
+        optimize_db_connection(conn)
+        c = conn.cursor()
+        
+        # Ensure required tables and stats tracking
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS cos_objects (
+                key TEXT PRIMARY KEY
+            )
+        """)
+        
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS copied_keys (
+                key TEXT PRIMARY KEY,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS failed_keys (
+                key TEXT PRIMARY KEY,
+                error TEXT,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+                attempts INTEGER DEFAULT 1
+            )
+        """)
+        
+        # Create indexes if they don't exist
+        create_indexes(conn)
+        
+        # Create archive stats table
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS archive_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_success INTEGER DEFAULT 0,
+                total_failures INTEGER DEFAULT 0,
+                start_time TEXT,
+                last_update_time TEXT,
+                finished_time TEXT
+            )
+        """)
+        
+        # Initialize or update stats
+        c.execute("""
+            INSERT OR REPLACE INTO archive_stats 
+            (id, total_success, total_failures, start_time, last_update_time) 
+            VALUES (
+                1, 
+                COALESCE((SELECT total_success FROM archive_stats WHERE id=1), 0),
+                COALESCE((SELECT total_failures FROM archive_stats WHERE id=1), 0),
+                COALESCE((SELECT start_time FROM archive_stats WHERE id=1), datetime('now')),
+                datetime('now')
+            )
+        """)
+        conn.commit()
+
 # Archive objects using multi-threaded processing
 def archive_objects(bucket_name, db_path, batch_size=100, max_workers=5):
     """
@@ -430,7 +514,7 @@ def archive_objects(bucket_name, db_path, batch_size=100, max_workers=5):
         bucket_name (str): Name of the bucket containing objects to archive
         db_path (str): Path to SQLite database containing object keys
         batch_size (int): Number of objects to fetch in each batch
-        max_workers (int): Maximum number of worker threads (capped at 5)
+        max_workers (int): Maximum number of worker threads (capped at MAX_ARCHIVE_WORKERS)
     """
     overall_start_time = time.time()
     overall_success = 0
@@ -439,33 +523,20 @@ def archive_objects(bucket_name, db_path, batch_size=100, max_workers=5):
     
     # Initial delay between operations for throttling
     current_delay = 0.1  # Start with a small delay
+    throttle = ThrottleController(current_delay)
     
     # Cap batch size and worker count to reasonable values
     batch_size = min(batch_size, 1000)
-    max_workers = min(max_workers, 5)  # Prevent system overload
+    max_workers = min(max_workers, MAX_ARCHIVE_WORKERS)  # Prevent system overload
     
     logger.info(f"Starting threaded archiving process for bucket: {bucket_name} with {max_workers} workers")
     logger.info(f"Initial throttling delay: {current_delay}s")
     
-    # Build up the S3 Client using environment variables
-    cos = client(
-        's3',
-        ibm_api_key_id=os.environ.get('IAM_API_KEY'),
-        config=Config(
-            signature_version='oauth',
-            max_pool_connections=max(50, max_workers * 5),  # Increase connection pool based on worker count
-            retries={'max_attempts': 0},  # We'll handle retries ourselves
-            connect_timeout=60,
-            read_timeout=60
-        ),
-        endpoint_url=f"https://s3.{os.environ.get('REGION')}.cloud-object-storage.appdomain.cloud"
-    )
-    
-    # Create a thread-safe queue for results
-    result_queue = queue.Queue()
+    # One client (and its connection pool) for all workers and batches
+    cos = get_archive_client()
     
     def archive_object(obj_key, throttle_delay):
-        """Worker function to archive a single object and report result"""
+        """Worker function to archive a single object. Returns (result_type, key, error)."""
         try:
             # Ensure that obj_key is a string
             obj_key = str(obj_key)
@@ -474,103 +545,51 @@ def archive_objects(bucket_name, db_path, batch_size=100, max_workers=5):
             if throttle_delay > 0:
                 time.sleep(throttle_delay)
             
-            # Perform in-place copy to trigger archiving with retry logic
-            copy_source = {'Bucket': bucket_name, 'Key': obj_key}
-            
-            def do_copy():
-                return cos.copy_object(
-                    Bucket=bucket_name,
-                    Key=obj_key,
-                    CopySource=copy_source,
-                    MetadataDirective='REPLACE'  # Keep the original metadata
-                )
-            
-            # Execute with retry logic
-            retry_with_backoff(do_copy)
+            # Perform in-place copy to trigger archiving (the client retries
+            # throttled and failed requests)
+            cos.copy_object(
+                Bucket=bucket_name,
+                Key=obj_key,
+                CopySource={'Bucket': bucket_name, 'Key': obj_key},
+                # COS rejects an in-place copy that keeps the metadata, so
+                # it has to be replaced (user metadata is not carried over)
+                MetadataDirective='REPLACE'
+            )
             
             # Report success
-            result_queue.put(('success', obj_key, None))
-            return True
+            return ('success', obj_key, None)
             
         except Exception as e:
             error_message = str(e)
             # Report failure
-            result_queue.put(('failure', obj_key, error_message))
-            return False
+            return ('failure', obj_key, error_message)
+    
+    # Tables, indexes and the stats row only need to be set up once per run
+    ensure_archive_schema(db_path)
+    
+    # Count the remaining objects once; every batch removes its rows from
+    # cos_objects, so the count is kept up to date without scanning the table
+    with sqlite3.connect(db_path, timeout=60) as conn:
+        objects_remaining = conn.execute("SELECT COUNT(*) FROM cos_objects").fetchone()[0]
+    
+    # The worker threads are started once and reused for every batch
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
     
     # Continue processing until we have no more objects or manual interruption
     try:
         while True:
             # Connect to the SQLite database (new connection for each batch to avoid issues)
-            with sqlite3.connect(db_path, timeout=60) as conn:
+            with sqlite3.connect(db_path, timeout=60, cached_statements=DB_CACHED_STATEMENTS) as conn:
                 optimize_db_connection(conn)
                 c = conn.cursor()
                 
-                # Ensure required tables and stats tracking
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS cos_objects (
-                        key TEXT PRIMARY KEY
-                    )
-                """)
-                
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS copied_keys (
-                        key TEXT PRIMARY KEY,
-                        timestamp TEXT DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS failed_keys (
-                        key TEXT PRIMARY KEY,
-                        error TEXT,
-                        timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-                        attempts INTEGER DEFAULT 1
-                    )
-                """)
-                
-                # Create indexes if they don't exist
-                create_indexes(conn)
-                
-                # Create archive stats table
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS archive_stats (
-                        id INTEGER PRIMARY KEY CHECK (id = 1),
-                        total_success INTEGER DEFAULT 0,
-                        total_failures INTEGER DEFAULT 0,
-                        start_time TEXT,
-                        last_update_time TEXT,
-                        finished_time TEXT
-                    )
-                """)
-                
-                # Initialize or update stats
-                c.execute("""
-                    INSERT OR REPLACE INTO archive_stats 
-                    (id, total_success, total_failures, start_time, last_update_time) 
-                    VALUES (
-                        1, 
-                        COALESCE((SELECT total_success FROM archive_stats WHERE id=1), 0),
-                        COALESCE((SELECT total_failures FROM archive_stats WHERE id=1), 0),
-                        COALESCE((SELECT start_time FROM archive_stats WHERE id=1), datetime('now')),
-                        datetime('now')
-                    )
-                """)
-                conn.commit()
-                
-                # Get current counts from stats
-                c.execute("SELECT total_success, total_failures FROM archive_stats WHERE id=1")
-                result = c.fetchone()
-                total_success, total_failures = result if result else (0, 0)
-                
-                # Get objects directly from cos_objects table
-                c.execute("""
-                    SELECT key FROM cos_objects
-                    LIMIT ?
-                """, (batch_size,))
+                # Get the objects with the lowest rowids from cos_objects;
+                # processed rows are deleted, so this is always the next batch
+                c.execute(SQL_SELECT_BATCH, (batch_size,))
+                rows = c.fetchall()
                 
                 # Extract the strings from the tuples
-                objects_to_archive = [row[0] for row in c.fetchall()]
+                objects_to_archive = [row[1] for row in rows]
                 
                 if not objects_to_archive:
                     logger.info("No more objects to archive. Process completed.")
@@ -589,90 +608,58 @@ def archive_objects(bucket_name, db_path, batch_size=100, max_workers=5):
                 batch_start_time = time.time()
                 success_count = 0
                 failure_count = 0
+                success_keys = []
+                failure_rows = []
                 
                 ############## PARALLEL PROCESSING WITH THREAD POOL ##############
-                # Process objects in parallel using a thread pool
-                with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    # Start all the archive tasks - pass strings and current throttle delay
-                    future_to_key = {executor.submit(archive_object, key, current_delay): key for key in objects_to_archive}
-                    
-                    # Process results from the queue while waiting for tasks to complete
-                    remaining_tasks = len(future_to_key)
-                    success_batch_count = 0
-                    failure_batch_count = 0
+                # Process objects in parallel on the shared thread pool
+                # Start all the archive tasks - pass strings and current throttle delay
+                future_to_key = {executor.submit(archive_object, key, current_delay): key for key in objects_to_archive}
+                
+                # Process results as the tasks complete
+                success_batch_count = 0
+                failure_batch_count = 0
 
-                    while remaining_tasks > 0:
-                        # Process up to 10 results at a time without logging each one
-                        for _ in range(min(10, remaining_tasks)):
-                            try:
-                                # Non-blocking queue check with timeout
-                                result_type, obj_key, error = result_queue.get(timeout=0.1)
-                                
-                                # Update database with result
-                                if result_type == 'success':
-                                    c.execute(
-                                        "INSERT OR REPLACE INTO copied_keys (key, timestamp) VALUES (?, datetime('now'))",
-                                        (obj_key,)
-                                    )
-                                    c.execute("DELETE FROM cos_objects WHERE key = ?", (obj_key,))
-                                    success_count += 1
-                                    success_batch_count += 1
-                                    
-                                else:  # failure
-                                    c.execute(
-                                        "INSERT OR REPLACE INTO failed_keys (key, error, timestamp, attempts) VALUES (?, ?, datetime('now'), COALESCE((SELECT attempts FROM failed_keys WHERE key = ?) + 1, 1))",
-                                        (obj_key, error, obj_key)
-                                    )
-                                    c.execute("DELETE FROM cos_objects WHERE key = ?", (obj_key,))
-                                    failure_count += 1
-                                    failure_batch_count += 1
-                                    # Only log individual failures at warning level
-                                    if len(error) > 100:
-                                        error = error[:100] + "..."
-                                    logger.warning(f"Failed to archive: {obj_key} - {error}")
-                                    
-                                # Mark task as processed
-                                result_queue.task_done()
-                                remaining_tasks -= 1
-                                
-                                # Commit periodically
-                                if (success_count + failure_count) % 20 == 0:
-                                    conn.commit()
-                                    
-                                    # Log progress periodically instead of per object
-                                    if (success_count + failure_count) % 100 == 0:
-                                        logger.info(f"Progress: {success_count + failure_count}/{len(objects_to_archive)} objects processed in this batch")
-                            
-                            except queue.Empty:
-                                # No results ready yet
-                                break
-                        
-                        # Check if we're done with all tasks
-                        if remaining_tasks == 0:
-                            break
-                            
-                        # Small sleep to prevent CPU spinning while waiting for results
-                        time.sleep(0.1)
-                        
-                        # Check for completed futures without forcing a timeout
-                        completed_futures = [future for future in future_to_key.keys() 
-                                            if future.done()]
+                for future in concurrent.futures.as_completed(future_to_key):
+                    result_type, obj_key, error = future.result()
+                    
+                    # Collect the result; the database is written once per batch
+                    if result_type == 'success':
+                        success_keys.append((obj_key,))
+                        success_count += 1
+                        success_batch_count += 1
                         
-                        # Process all completed futures
-                        for future in completed_futures:
-                            del future_to_key[future]
+                    else:  # failure
+                        failure_rows.append((obj_key, error))
+                        failure_count += 1
+                        failure_batch_count += 1
+                        # Only log individual failures at warning level
+                        if len(error) > 100:
+                            error = error[:100] + "..."
+                        logger.warning(f"Failed to archive: {obj_key} - {error}")
+                    
+                    # Log progress periodically instead of per object
+                    if (success_count + failure_count) % 100 == 0:
+                        logger.info(f"Progress: {success_count + failure_count}/{len(objects_to_archive)} objects processed in this batch")
                 
                 ############## BATCH COMPLETION AND STATISTICS ##############
-                # Calculate success rate for this batch for adaptive throttling
-                batch_total = success_count + failure_count
-                success_rate = success_count / batch_total if batch_total > 0 else 0
+                # Record the whole batch in one transaction (committed together
+                # with the stats below)
+                c.executemany(SQL_INSERT_COPIED_KEY, success_keys)
+                c.executemany(SQL_INSERT_FAILED_KEY, failure_rows)
+                
+                # Every object of the batch has been recorded as copied or failed.
+                # The batch is the contiguous rowid range it was selected as, so
+                # it is removed from cos_objects with a single range delete.
+                c.execute(SQL_DELETE_COS_OBJECT_RANGE, (rows[0][0], rows[-1][0]))
+                objects_remaining -= len(rows)
                 
-                # Update throttling based on success rate
+                # Update throttling based on the failure rate
                 previous_delay = current_delay
-                current_delay = adaptive_throttle(success_rate, current_delay)
+                current_delay = throttle.update(success_count, failure_count)
                 
                 if previous_delay != current_delay:
-                    logger.info(f"Adaptive throttling: Success rate {success_rate:.2f}, adjusting delay from {previous_delay:.3f}s to {current_delay:.3f}s")
+                    logger.info(f"Adaptive throttling: Failure rate {throttle.failure_ewma:.2f} (averaged), adjusting delay from {previous_delay:.3f}s to {current_delay:.3f}s")
                 
                 # Final update of stats for this batch
                 overall_success += success_count
@@ -680,16 +667,15 @@ def archive_objects(bucket_name, db_path, batch_size=100, max_workers=5):
                 total_batches += 1
                 
                 # Update stats
-                c.execute("""
-                    UPDATE archive_stats 
-                    SET total_success = total_success + ?, 
-                        total_failures = total_failures + ?, 
-                        last_update_time = datetime('now')
-                    WHERE id = 1
-                """, (success_count, failure_count))
+                c.execute(SQL_UPDATE_ARCHIVE_STATS, (success_count, failure_count))
                 
                 conn.commit()
                 
+                # Checkpoint while no copies are running, so an
+                # autocheckpoint does not stall the commit of a later batch
+                if total_batches % WAL_CHECKPOINT_BATCHES == 0:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                
                 batch_end_time = time.time()
                 batch_duration = batch_end_time - batch_start_time
                 rate = len(objects_to_archive) / batch_duration if batch_duration > 0 else 0
@@ -705,10 +691,6 @@ def archive_objects(bucket_name, db_path, batch_size=100, max_workers=5):
                 elapsed_time = time.time() - overall_start_time
                 objects_processed = overall_success + overall_failures
                 
-                # Get total objects remaining - use the same connection that's still open
-                c.execute("SELECT COUNT(*) FROM cos_objects")
-                objects_remaining = c.fetchone()[0]
-                
                 if objects_processed > 0 and elapsed_time > 0:
                     rate_overall = objects_processed / elapsed_time
                     if rate_overall > 0:
@@ -718,27 +700,24 @@ def archive_objects(bucket_name, db_path, batch_size=100, max_workers=5):
                         
                         logger.info(f"Progress: {objects_processed} processed, {objects_remaining} remaining")
                         logger.info(f"Estimated time remaining: {est_days_remaining:.2f} days ({est_hours_remaining:.2f} hours)")
-                
-                # Optional: Add a small delay between batches
-                time.sleep(1)
     
     except KeyboardInterrupt:
         logger.warning("Process interrupted by user.")
-        # Drain the queue to log any unprocessed results
-        drain_result_queue(result_queue)  # Pass the queue explicitly
         elapsed_time = time.time() - overall_start_time
         logger.info(f"Process ran for {elapsed_time/3600:.2f} hours.")
         logger.info(f"Processed {overall_success + overall_failures} objects (Success: {overall_success}, Failed: {overall_failures})")
     
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
-        # Drain the queue to log any unprocessed results
-        drain_result_queue(result_queue)  # Pass the queue explicitly
         elapsed_time = time.time() - overall_start_time
         logger.info(f"Process ran for {elapsed_time/3600:.2f} hours before error.")
         logger.info(f"Processed {overall_success + overall_failures} objects (Success: {overall_success}, Failed: {overall_failures})")
         raise
     
+    finally:
+        # Don't start queued copies of an interrupted batch
+        executor.shutdown(wait=True, cancel_futures=True)
+    
     # Final summary
     elapsed_time = time.time() - overall_start_time
     logger.info("=" * 60)
@@ -756,11 +735,21 @@ def update_database_schema(db_path):
     logger.info("Checking database schema and updating if needed...")
     
     with sqlite3.connect(db_path) as conn:
+        optimize_db_connection(conn)
         c = conn.cursor()
         
+        # Get the columns of both tables with one query
+        c.execute("""
+            SELECT m.name, p.name
+            FROM sqlite_master AS m, pragma_table_info(m.name) AS p
+            WHERE m.type = 'table' AND m.name IN ('copied_keys', 'failed_keys')
+        """)
+        table_columns = {"copied_keys": set(), "failed_keys": set()}
+        for table, column in c.fetchall():
+            table_columns[table].add(column)
+        
         # Check copied_keys table
-        c.execute("PRAGMA table_info(copied_keys)")
-        columns = {row[1] for row in c.fetchall()}
+        columns = table_columns["copied_keys"]
         if "timestamp" not in columns:
             logger.info("Adding timestamp column to copied_keys table")
             # Add column without default value first
@@ -769,8 +758,7 @@ def update_database_schema(db_path):
             c.execute("UPDATE copied_keys SET timestamp = datetime('now') WHERE timestamp IS NULL")
         
         # Check failed_keys table
-        c.execute("PRAGMA table_info(failed_keys)")
-        columns = {row[1] for row in c.fetchall()}
+        columns = table_columns["failed_keys"]
         if "error" not in columns:
             logger.info("Adding error column to failed_keys table")
             c.execute("ALTER TABLE failed_keys ADD COLUMN error TEXT")
@@ -792,75 +780,85 @@ def update_database_schema(db_path):
     logger.info("Database schema update completed")
 
 ################### ADAPTIVE THROTTLING ###################
-# Adjust throttling based on success rate
-def adaptive_throttle(success_rate, current_delay):
+# Adjust throttling based on the failure rate of the recent batches
+class ThrottleController:
     """
-    Adjust throttling based on success rate.
-    Returns a new delay value in seconds.
+    Computes the delay before each copy once per batch.
+    The failure ratio of the batches is smoothed with an exponentially
+    weighted moving average, and the delay only changes once the average has
+    been above FAILURE_HIGH (or below FAILURE_LOW) for `hysteresis` batches
+    in a row, so single bad batches do not make the delay oscillate.
     """
-    if success_rate > 0.95:  # Very successful
-        return max(0.05, current_delay * 0.9)  # Reduce delay
-    elif success_rate < 0.8:  # Lots of errors
-        return min(1.0, current_delay * 1.5)   # Increase delay
-    else:
-        return current_delay  # Keep current delay
+    FAILURE_HIGH = 0.1
+    FAILURE_LOW = 0.05
+
+    def __init__(self, delay, alpha=0.3, hysteresis=3, min_delay=0.05, max_delay=1.0):
+        self.delay = delay
+        self.alpha = alpha
+        self.hysteresis = hysteresis
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.failure_ewma = 0.0
+        self.batches_high = 0
+        self.batches_low = 0
+
+    def update(self, success_count, failure_count):
+        """Record the results of a batch and return the delay for the next one."""
+        batch_total = success_count + failure_count
+        if batch_total == 0:
+            return self.delay
+        
+        failure_ratio = failure_count / batch_total
+        self.failure_ewma = self.alpha * failure_ratio + (1 - self.alpha) * self.failure_ewma
+        
+        if self.failure_ewma > self.FAILURE_HIGH:
+            self.batches_high += 1
+            self.batches_low = 0
+        elif self.failure_ewma < self.FAILURE_LOW:
+            self.batches_low += 1
+            self.batches_high = 0
+        else:
+            self.batches_high = 0
+            self.batches_low = 0
+        
+        if self.batches_high >= self.hysteresis:  # Lots of errors
+            self.delay = min(self.max_delay, self.delay * 1.5)  # Increase delay
+        elif self.batches_low >= self.hysteresis:  # Very successful
+            self.delay = max(self.min_delay, self.delay * 0.9)  # Reduce delay
+        return self.delay
 
 ################### CHECKPOINTING FUNCTIONS ###################
 # Create checkpoint files for recovery
+CHECKPOINT_SLOTS = 5
+_checkpoint_counter = 0
+
 def write_checkpoint(stats_dict, prefix="archive_checkpoint"):
-    """Write a checkpoint file with current statistics."""
-    filename = f"{prefix}_{int(time.time())}.json"
-    with open(filename, "w") as f:
-        json.dump(stats_dict, f)
+    """
+    Write a checkpoint file with current statistics.
+    The files rotate through CHECKPOINT_SLOTS fixed names, so only the most
+    recent checkpoints are kept without scanning the directory.
+    """
+    global _checkpoint_counter
+    filename = f"{prefix}_{_checkpoint_counter % CHECKPOINT_SLOTS}.json"
+    _checkpoint_counter += 1
     
-    # Keep only the 5 most recent checkpoints
-    import glob
-    checkpoints = sorted(glob.glob(f"{prefix}_*.json"))
-    for old_checkpoint in checkpoints[:-5]:
-        os.remove(old_checkpoint)
+    # Write to a temporary file first so a checkpoint is never half written
+    with open(f"{filename}.tmp", "w") as f:
+        json.dump(stats_dict, f)
+    os.replace(f"{filename}.tmp", filename)
 
 ################### RESOURCE OPTIMIZATION ###################
 # Functions to optimize resource usage
-def adjust_thread_count(current_workers, success_rate, queue_length):
-    """Dynamically adjust worker count based on system performance"""
-    if success_rate < 0.7:  # Too many errors
-        return max(2, int(current_workers * 0.8))  # Reduce workers
-    elif success_rate > 0.95 and queue_length > current_workers * 2:
-        return min(5, current_workers + 1)  # Increase workers, now limited to 5
-    return current_workers
-
+@functools.lru_cache(maxsize=1)
 def get_optimal_thread_count():
-    """Calculate optimal thread count based on system resources"""
+    """Calculate optimal thread count based on system resources (computed once, the hardware does not change)"""
+    import psutil
+    
     cpu_count = psutil.cpu_count(logical=True)
     memory_gb = psutil.virtual_memory().total / (1024**3)
     # Balance between CPU and memory consideration
     return min(max(2, cpu_count - 1), int(memory_gb / 2), 20)
 
-################### ERROR HANDLING ###################
-# Process any remaining results in the queue before exiting
-def drain_result_queue(result_queue_param=None):
-    """Process any remaining results in the queue before exiting"""
-    try:
-        # Use the parameter if provided, otherwise try to use the global
-        queue_to_drain = result_queue_param
-        
-        if queue_to_drain is None:
-            # Only try to access the global if no parameter was provided
-            try:
-                global result_queue
-                queue_to_drain = result_queue
-            except NameError:
-                logger.error("Result queue not available")
-                return
-        
-        while not queue_to_drain.empty():
-            result_type, obj_key, error = queue_to_drain.get_nowait()
-            # Log results that couldn't be processed
-            logger.warning(f"Unprocessed result: {result_type} for {obj_key}")
-            queue_to_drain.task_done()
-    except Exception as e:
-        logger.error(f"Error draining result queue: {str(e)}")
-
 ################### OBJECT LISTING WITH DATE FILTER ###################
 # List objects from COS bucket to SQLite database, filtering by creation date
 def list_cos_objects_to_sqlite_with_date_filter(bucket_name, db_path, cutoff_date="2025-07-13", continuation_token=None):
@@ -885,6 +883,9 @@ def list_cos_objects_to_sqlite_with_date_filter(bucket_name, db_path, cutoff_dat
     
     logger.info(f"Starting listing objects from bucket: {bucket_name} (created before {cutoff_date.strftime('%Y-%m-%d')})")
     
+    from ibm_boto3 import client
+    from ibm_botocore.client import Config
+    
     # Build up the S3 Client using environment variables
     cos = client(
         's3',
@@ -892,7 +893,7 @@ def list_cos_objects_to_sqlite_with_date_filter(bucket_name, db_path, cutoff_dat
         config=Config(
             signature_version='oauth',
             max_pool_connections=100,
-            retries={'max_attempts': 3},
+            retries=COS_RETRIES,
             connect_timeout=60,
             read_timeout=60
         ),
@@ -900,18 +901,27 @@ def list_cos_objects_to_sqlite_with_date_filter(bucket_name, db_path, cutoff_dat
     )
 
     # SQLite DB connection
-    with sqlite3.connect(db_path, timeout=60) as conn:
-        optimize_db_connection(conn)
+    # Skip fsync only while the database holds nothing but listing data
+    bulk_load = not has_archive_records(db_path)
+    if not bulk_load:
+        logger.info("Database already holds archiving results, listing with synchronous commits")
+    
+    # Autocommit mode: the merge transactions are opened explicitly below
+    with sqlite3.connect(db_path, timeout=60, cached_statements=DB_CACHED_STATEMENTS, isolation_level=None) as conn:
+        optimize_db_connection(conn, bulk_load=bulk_load)
         c = conn.cursor()
         
         # Create needed tables
         c.execute("""
             CREATE TABLE IF NOT EXISTS cos_objects (
                 key TEXT PRIMARY KEY,
-                last_modified TEXT
+                last_modified INTEGER  -- Unix epoch seconds
             )
         """)
         
+        # Unindexed staging table, kept in memory and private to this connection
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS staged_objects (key TEXT, last_modified INTEGER)")
+        
         c.execute("""
             CREATE TABLE IF NOT EXISTS continuation_state (
                 id INTEGER PRIMARY KEY CHECK (id = 1),
@@ -957,121 +967,82 @@ def list_cos_objects_to_sqlite_with_date_filter(bucket_name, db_path, cutoff_dat
                     filtered_objects = result[1]
                     logger.info(f"Already processed {total_objects} objects in previous runs (filtered: {filtered_objects})")
 
-        # Create transaction batches to avoid enormous transactions
-        tx_batch_size = 10000
-        objects_in_current_tx = 0
-        objects_processed_since_cursor_reset = 0
-        
         try:
             # Initialize response outside the loop
             more_objects = True
+            staged_pages = 0
+            staged_count = 0
+            staged_filtered_count = 0
+            last_merge_time = time.time()
             
-            while more_objects:
-                # Prepare parameters for listing objects
-                list_objects_params = {
-                    "Bucket": bucket_name,
-                    "MaxKeys": 1000
-                }
-                # Add continuation token if we have one
-                if continuation_token:
-                    list_objects_params["ContinuationToken"] = continuation_token
-                
-                # Get the objects with retry logic
-                def list_objects():
-                    return cos.list_objects_v2(**list_objects_params)
-                    
+            # The next page is already being fetched while this one is written
+            for response in prefetch_list_pages(cos, bucket_name, continuation_token):
                 try:
-                    response = retry_with_backoff(list_objects)
+                    # Process contents; LastModified is parsed into a
+                    # timezone-aware datetime by the client. Only objects
+                    # created before the cutoff date are kept.
+                    contents = response.get("Contents", [])
+                    rows = [
+                        (obj["Key"], int(obj["LastModified"].timestamp()))
+                        for obj in contents
+                        if obj["LastModified"] < cutoff_date
+                    ]
                     
-                    # Process contents
-                    batch_count = 0
-                    filtered_batch_count = 0
+                    # Append the kept keys of the page to the staging table;
+                    # the staged pages and their merge form one transaction
+                    if staged_pages == 0:
+                        c.execute("BEGIN")
+                    c.executemany(SQL_STAGE_COS_OBJECT_WITH_DATE, rows)
+                    staged_pages += 1
+                    # Add all objects to total count for reporting
+                    staged_count += len(contents)
+                    staged_filtered_count += len(rows)
+                    logger.info(f"Staged batch with {len(contents)} objects, kept {len(rows)} within date range.")
                     
-                    for obj in response.get("Contents", []):
-                        # Get the object's last modified date
-                        obj_last_modified = obj.get("LastModified")
-                        
-                        # Convert to datetime if it's not already
-                        if isinstance(obj_last_modified, str):
-                            obj_last_modified = datetime.fromisoformat(obj_last_modified.replace('Z', '+00:00'))
-                            
-                        # Add all objects to total count for reporting
-                        total_objects += 1
-                        
-                        # Only insert objects created before the cutoff date
-                        if obj_last_modified < cutoff_date:
-                            c.execute(
-                                "INSERT OR REPLACE INTO cos_objects (key, last_modified) VALUES (?, ?)",
-                                (obj["Key"], obj_last_modified.isoformat())
-                            )
-                            filtered_objects += 1
-                            filtered_batch_count += 1
-                            objects_in_current_tx += 1
-                            
-                        batch_count += 1
-                        objects_processed_since_cursor_reset += 1
-                        
-                        # Commit in smaller batches to avoid huge transactions
-                        if objects_in_current_tx >= tx_batch_size:
-                            conn.commit()
-                            # Update stats
-                            c.execute("""
-                                UPDATE listing_stats 
-                                SET total_objects = ?, filtered_objects = ?, last_update_time = datetime('now')
-                                WHERE id = 1
-                            """, (total_objects, filtered_objects))
-                            conn.commit()
-                            objects_in_current_tx = 0
+                    next_token = response.get("NextContinuationToken")
+                    if (next_token and staged_pages < LISTING_MERGE_PAGES
+                            and time.time() - last_merge_time < LISTING_MERGE_INTERVAL):
+                        continue
                     
-                    logger.info(f"Processed batch with {batch_count} objects, kept {filtered_batch_count} within date range.")
-                    logger.info(f"Total processed: {total_objects}, filtered: {filtered_objects}")
+                    # Merge the staged pages in key order; keys that are
+                    # already listed are skipped
+                    c.execute(SQL_MERGE_STAGED_OBJECTS_WITH_DATE)
+                    c.execute(SQL_CLEAR_STAGED_OBJECTS)
+                    c.execute(SQL_UPDATE_FILTERED_LISTING_STATS, (total_objects + staged_count, filtered_objects + staged_filtered_count))
                     
-                    # Save progress after processing each batch
-                    if response.get("NextContinuationToken"):
-                        continuation_token = response["NextContinuationToken"]
-                        c.execute("""
-                            INSERT OR REPLACE INTO continuation_state (id, continuation_token, last_updated) 
-                            VALUES (1, ?, CURRENT_TIMESTAMP)
-                        """, (continuation_token,))
-                        conn.commit()
+                    # The token is only saved together with the keys it covers
+                    if next_token:
+                        c.execute(SQL_SAVE_CONTINUATION_TOKEN, (next_token,))
+                    
+                    c.execute("COMMIT")
+                    total_objects += staged_count
+                    filtered_objects += staged_filtered_count
+                    logger.info(f"Merged {staged_pages} staged batches.")
+                    logger.info(f"Total processed: {total_objects}, filtered: {filtered_objects}")
+                    staged_pages = 0
+                    staged_count = 0
+                    staged_filtered_count = 0
+                    last_merge_time = time.time()
+                    if next_token:
                         logger.info(f"Continuation token saved.")
                     else:
                         more_objects = False
                         logger.info("Reached end of bucket listing.")
                 
                 except Exception as e:
-                    # If we fail during a batch, save what we have and re-raise
+                    # Batches staged since the last merge are not committed and
+                    # are listed again from the saved token
                     logger.error(f"Error during object listing: {str(e)}")
-                    if objects_in_current_tx > 0:
-                        conn.commit()
-                        logger.info(f"Saved progress before error, total processed: {total_objects}")
                     raise
                     
-                # Reset cursor periodically
-                if objects_processed_since_cursor_reset >= 100000:
-                    # Commit any pending changes first
-                    if objects_in_current_tx > 0:
-                        conn.commit()
-                        objects_in_current_tx = 0
-                    
-                    # Close and recreate cursor
-                    logger.debug("Recycling database cursor after 100,000 objects")
-                    c.close()
-                    c = conn.cursor()
-                    objects_processed_since_cursor_reset = 0
-                    
         except KeyboardInterrupt:
             logger.warning("Process interrupted. Progress has been saved.")
-            conn.commit()
+            conn.rollback()
         except Exception as e:
             logger.error(f"Error: {str(e)}")
-            conn.commit()
+            conn.rollback()
             raise
         finally:
-            # Make sure changes are committed
-            if objects_in_current_tx > 0:
-                conn.commit()
-                
             # Update final stats
             c.execute("""
                 UPDATE listing_stats 